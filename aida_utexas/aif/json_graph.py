@@ -320,6 +320,16 @@ class JsonGraph:
     def stmt_predicate(self, stmt_label):
         return self.node_dict[stmt_label].predicate if self.is_statement(stmt_label) else None
 
+    # map each statement node to its (subject, predicate, object) triple, for bulk lookups
+    def build_stmt_spo_index(self):
+        return {node_label: (node.subject, node.predicate, node.object)
+                for node_label, node in self.node_dict.items() if node.type == 'Statement'}
+
+    # the set of all event and relation nodes, for bulk membership tests
+    def build_event_relation_index(self):
+        return frozenset(node_label for node_label, node in self.node_dict.items()
+                         if node.type in ('Event', 'Relation'))
+
     # subject or object of a statement node
     def stmt_arg_by_role(self, stmt_label, role_label):
         if self.is_statement(stmt_label):
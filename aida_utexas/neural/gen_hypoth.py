@@ -134,10 +134,16 @@ def main():
 
     parser.add_argument("--attention_type", type=str, default='concat')
     parser.add_argument("--num_layers", type=int, default=2)
+    parser.add_argument("--share_layer_weights", action='store_true', default=False,
+                        help='If specified, GCN layers 3 and 4 reuse the weights of layer 2 '
+                             '(must match how the checkpoint was trained)')
     parser.add_argument("--hidden_size", type=int, default=300)
     parser.add_argument("--attention_size", type=int, default=300)
     parser.add_argument("--conv_dropout", type=float, default=.5)
     parser.add_argument("--attention_dropout", type=float, default=.3)
+    parser.add_argument("--bf16_embeddings", action='store_true', default=False,
+                        help='If specified, store the ERE/stmt embedding tables in bfloat16 '
+                             '(halves their memory and lookup traffic; the rest of the model runs in float32)')
 
     parser.add_argument('-f', '--force', action='store_true', default=False,
                         help='If specified, overwrite existing output files without warning')
@@ -189,11 +195,16 @@ def main():
         args.hidden_size,
         args.attention_size,
         args.conv_dropout,
-        args.attention_dropout)
+        args.attention_dropout,
+        args.share_layer_weights)
 
     model_path = str(util.get_input_path(args.model_path))
     model.load_state_dict(torch.load(model_path, map_location=torch.device('cpu'))['model'])
 
+    if args.bf16_embeddings:
+        model.ere_embedder.to(dtype=torch.bfloat16)
+        model.stmt_embedder.to(dtype=torch.bfloat16)
+
     model.to(device)
     model.eval()
 
@@ -205,7 +216,8 @@ def main():
 
     print('\nExpanding cluster seeds ...')
 
-    evaluate(seed_dir, indexed_data_dir, output_dir, model, device)
+    with torch.no_grad():
+        evaluate(seed_dir, indexed_data_dir, output_dir, model, device)
 
     print(f'\nExpanding finished: raw hypotheses in directory {output_dir}')
 
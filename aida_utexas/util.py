@@ -5,6 +5,11 @@ import sys
 from pathlib import Path
 from typing import List, Union
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def get_input_path(path: Union[str, Path], check_exist: bool = True) -> Path:
     if isinstance(path, str):
@@ -97,5 +102,14 @@ def read_json_file(file_path: Union[str, Path], file_desc: str = None):
     file_path = get_input_path(file_path, check_exist=True)
     file_desc = file_desc or 'JSON object'
     logging.info(f'Reading {file_desc} from {file_path} ...')
-    with open(str(file_path), 'r') as fin:
-        return json.load(fin)
+    if orjson is None:
+        with open(str(file_path), 'r') as fin:
+            return json.load(fin)
+
+    with open(str(file_path), 'rb') as fin:
+        data = fin.read()
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # orjson is stricter than json (e.g., it rejects NaN / Infinity and oversized integers)
+        return json.loads(data)
@@ -7,20 +7,25 @@
 ######
 
 import argparse
+import mmap
 import os
+import pickle
 import random
+import sys
 import time
 from collections import defaultdict
-from copy import deepcopy
+from copy import copy, deepcopy
 from pathlib import Path
 from gen_single_doc_graphs import verify_dir, Ere, Stmt, Graph
 import dill
 from tqdm import tqdm
-import itertools
 import math
 import networkx as nx
 from networkx.algorithms.approximation.steinertree import steiner_tree
 
+# Whether to run the (expensive) per-ERE structural sanity checks on each created graph salad
+VALIDATE_SALADS = False
+
 ##### GRAPH SALAD CREATION #####
 
 # Create an initial query set around a given ERE
@@ -30,149 +35,308 @@ def retrieve_related_stmt_ids(graph, root_id, max_num_neigh_ere_ids=2):
     # Select at most 2 neighbor ERE's
     neighbor_ere_ids = root_ere.neighbor_ere_ids
     if len(neighbor_ere_ids) > max_num_neigh_ere_ids:
-        neighbor_ere_ids = random.sample(neighbor_ere_ids, max_num_neigh_ere_ids)
+        neighbor_ere_ids = random.sample(list(neighbor_ere_ids), max_num_neigh_ere_ids)
+
+    eres = graph.eres
+    stmts = graph.stmts
 
     stmt_set = set()
+    add = stmt_set.add
 
     for neighbor_ere_id in neighbor_ere_ids:
-        stmt_set.update([stmt_id for stmt_id in graph.eres[root_id].stmt_ids if (neighbor_ere_id in [graph.stmts[stmt_id].head_id, graph.stmts[stmt_id].tail_id]) or (graph.stmts[stmt_id].tail_id is None)])
-        stmt_set.update([stmt_id for stmt_id in graph.eres[neighbor_ere_id].stmt_ids if graph.stmts[stmt_id].tail_id is None])
+        for stmt_id in root_ere.stmt_ids:
+            stmt = stmts[stmt_id]
+            tail_id = stmt.tail_id
+            if tail_id is None or neighbor_ere_id == stmt.head_id or neighbor_ere_id == tail_id:
+                add(stmt_id)
+
+        for stmt_id in eres[neighbor_ere_id].stmt_ids:
+            if stmts[stmt_id].tail_id is None:
+                add(stmt_id)
 
     return stmt_set
 
-# Checks whether <new_ere_id> is reachable from <target_ere_id> in <graph>
-def reachable(graph, target_ere_id, new_ere_id):
-    seen_eres = set()
-    curr_eres = [target_ere_id]
+# Map each ERE ID in <graph> to an integer label identifying its connected component, so that two EREs are mutually reachable iff they share a label
+def component_map(graph):
+    eres = graph.eres
+    components = dict()
 
-    while new_ere_id not in seen_eres:
-        seen_eres.update(curr_eres)
-        next_eres = set([item for neighs in [graph.eres[ere_id].neighbor_ere_ids for ere_id in curr_eres] for item in neighs]) - seen_eres
-        if not next_eres and new_ere_id not in seen_eres:
-            return False
+    for ere_id in eres.keys():
+        if ere_id in components:
+            continue
+
+        label = len(components)
+        components[ere_id] = label
+        curr_eres = [ere_id]
+
+        while curr_eres:
+            next_eres = []
+
+            for curr_id in curr_eres:
+                for neighbor_id in eres[curr_id].neighbor_ere_ids:
+                    if neighbor_id not in components:
+                        components[neighbor_id] = label
+                        next_eres.append(neighbor_id)
+
+            curr_eres = next_eres
+
+    return components
 
-        curr_eres = list(next_eres)
+# Map each ERE in <graph> to its adjacent stmts and to its neighbor EREs with a single pass over the stmts
+def index_stmts(graph):
+    ere_to_stmts = defaultdict(set)
+    ere_to_neighbors = defaultdict(set)
 
-    return True
+    for stmt_id, stmt in graph.stmts.items():
+        ere_to_stmts[stmt.head_id].add(stmt_id)
+
+        if stmt.tail_id:
+            ere_to_stmts[stmt.tail_id].add(stmt_id)
+            ere_to_neighbors[stmt.head_id].add(stmt.tail_id)
+            ere_to_neighbors[stmt.tail_id].add(stmt.head_id)
+
+    return ere_to_stmts, ere_to_neighbors
+
+# Structural copies of EREs, stmts and graphs (much cheaper than deepcopy); only the mutable ID sets are copied. These only read
+# instance attributes, since graphs unpickled from existing files carry their own copies of the Ere/Stmt/Graph classes
+def clone_ere(ere):
+    new_ere = copy(ere)
+    new_ere.neighbor_ere_ids = ere.neighbor_ere_ids.copy()
+    new_ere.stmt_ids = ere.stmt_ids.copy()
+    return new_ere
+
+def clone_stmt(stmt):
+    new_stmt = copy(stmt)
+    new_stmt.dup_ids = stmt.dup_ids.copy()
+    return new_stmt
+
+# The connectedness maps are shared with the original graph, as they are never mutated
+def clone_graph(graph):
+    new_graph = copy(graph)
+    new_graph.eres = {ere_id: clone_ere(ere) for ere_id, ere in graph.eres.items()}
+    new_graph.stmts = {stmt_id: clone_stmt(stmt) for stmt_id, stmt in graph.stmts.items()}
+    return new_graph
 
 # Replace the node with ID <source_id> with <target_ere> in <graph>
 def replace_ere(graph, source_id, target_ere):
-    neighbor_ere_ids = graph.eres[source_id].neighbor_ere_ids.copy()
-    stmt_ids = graph.eres[source_id].stmt_ids.copy()
+    eres = graph.eres
+    stmts = graph.stmts
+    target_id = target_ere.id
+
+    neighbor_ere_ids = eres[source_id].neighbor_ere_ids.copy()
+    stmt_ids = eres[source_id].stmt_ids.copy()
 
-    del graph.eres[source_id]
+    del eres[source_id]
 
-    graph.eres[target_ere.id] = deepcopy(target_ere)
-    graph.eres[target_ere.id].neighbor_ere_ids = neighbor_ere_ids
-    graph.eres[target_ere.id].stmt_ids = stmt_ids
+    new_ere = clone_ere(target_ere)
+    new_ere.neighbor_ere_ids = neighbor_ere_ids
+    new_ere.stmt_ids = stmt_ids
+    eres[target_id] = new_ere
 
     for stmt_id in stmt_ids:
-        if graph.stmts[stmt_id].tail_id == source_id:
-            graph.stmts[stmt_id].tail_id = target_ere.id
-            graph.eres[graph.stmts[stmt_id].head_id].neighbor_ere_ids.discard(source_id)
-            graph.eres[graph.stmts[stmt_id].head_id].neighbor_ere_ids.add(target_ere.id)
-        if graph.stmts[stmt_id].head_id == source_id:
-            graph.stmts[stmt_id].head_id = target_ere.id
-            if graph.stmts[stmt_id].tail_id is not None:
-                graph.eres[graph.stmts[stmt_id].tail_id].neighbor_ere_ids.discard(source_id)
-                graph.eres[graph.stmts[stmt_id].tail_id].neighbor_ere_ids.add(target_ere.id)
+        stmt = stmts[stmt_id]
+
+        if stmt.tail_id == source_id:
+            stmt.tail_id = target_id
+            head_neighbors = eres[stmt.head_id].neighbor_ere_ids
+            head_neighbors.discard(source_id)
+            head_neighbors.add(target_id)
+        if stmt.head_id == source_id:
+            stmt.head_id = target_id
+            if stmt.tail_id is not None:
+                tail_neighbors = eres[stmt.tail_id].neighbor_ere_ids
+                tail_neighbors.discard(source_id)
+                tail_neighbors.add(target_id)
 
 # If an <num_abridge_hops> value is specified, this function crops the graph salad such that all EREs in the
 # cropped graph are no more than <num_abridge_hops> traversals from some merge point.
 def abridge_graph(graph_mix, target_graph_id, num_abridge_hops):
+    eres = graph_mix.eres
+    stmts = graph_mix.stmts
+
     # Find all merge points (event or entity)
-    merge_points = {item for item in graph_mix.eres.keys() if len({graph_mix.stmts[stmt_id].graph_id for stmt_id in graph_mix.eres[item].stmt_ids}) > 1}
-    before_merge_points = deepcopy(merge_points)
+    merge_points = {ere_id for ere_id, ere in eres.items() if len({stmts[stmt_id].graph_id for stmt_id in ere.stmt_ids}) > 1}
+    before_merge_points = merge_points.copy()
 
     seen_eres = set()
-    curr_eres = deepcopy(merge_points)
+    curr_eres = merge_points.copy()
 
     net = nx.Graph()
 
-    for ere_id in [item for item in graph_mix.eres.keys() if graph_mix.eres[item].graph_id == target_graph_id]:
-        net.add_node(ere_id)
+    for ere_id, ere in eres.items():
+        if ere.graph_id == target_graph_id:
+            net.add_node(ere_id)
 
-    for stmt_id in [item for item in graph_mix.stmts.keys() if graph_mix.stmts[item].tail_id and graph_mix.stmts[item].graph_id == target_graph_id]:
-        net.add_edge(graph_mix.stmts[stmt_id].head_id, graph_mix.stmts[stmt_id].tail_id)
-        net.edges[graph_mix.stmts[stmt_id].head_id, graph_mix.stmts[stmt_id].tail_id]['name'] = stmt_id
+    for stmt_id, stmt in stmts.items():
+        if stmt.tail_id and stmt.graph_id == target_graph_id:
+            net.add_edge(stmt.head_id, stmt.tail_id, name=stmt_id)
 
     st_tree_stmts = {net.edges[item[0], item[1]]['name'] for item in list(steiner_tree(net, merge_points).edges)}
 
-    for stmt_id in deepcopy(st_tree_stmts):
-        stmt = graph_mix.stmts[stmt_id]
+    # Pull in any parallel stmts sharing a head and tail with a Steiner tree edge
+    for stmt_id in st_tree_stmts.copy():
+        stmt = stmts[stmt_id]
+        head_id = stmt.head_id
+        tail_id = stmt.tail_id
+
+        for item in eres[head_id].stmt_ids:
+            other = stmts[item]
+            if other.tail_id and other.head_id == head_id and other.tail_id == tail_id:
+                st_tree_stmts.add(item)
 
-        st_tree_stmts.update({item for item in graph_mix.eres[stmt.head_id].stmt_ids if graph_mix.stmts[item].tail_id and graph_mix.stmts[item].head_id == stmt.head_id and graph_mix.stmts[item].tail_id == stmt.tail_id})
+    st_tree_eres = set()
 
-    st_tree_eres = set.union(*[{graph_mix.stmts[stmt_id].head_id, graph_mix.stmts[stmt_id].tail_id} for stmt_id in st_tree_stmts])
+    for stmt_id in st_tree_stmts:
+        stmt = stmts[stmt_id]
+        st_tree_eres.add(stmt.head_id)
+        st_tree_eres.add(stmt.tail_id)
 
     i = 0
 
     # Traverse out <num_abridge_hops> from all merge points
     while len(curr_eres) > 0 and i < num_abridge_hops:
         seen_eres.update(curr_eres)
-        curr_eres = set.union(*[graph_mix.eres[ere_id].neighbor_ere_ids for ere_id in curr_eres]) - seen_eres
+
+        next_eres = set()
+
+        for ere_id in curr_eres:
+            next_eres |= eres[ere_id].neighbor_ere_ids
+
+        curr_eres = next_eres - seen_eres
 
         i += 1
 
     # Determine the set of stmts which are reachable via <num_abridge_hops> or less hops from any merge point.
-    reachable_stmts = set.union(*[graph_mix.eres[ere_id].stmt_ids for ere_id in seen_eres])
+    reachable_stmts = set()
+
+    for ere_id in seen_eres:
+        reachable_stmts |= eres[ere_id].stmt_ids
+
     seen_eres.update(curr_eres)
 
     # Make sure we include both relation statements in the set of reachable stmts for each reachable relation node.
-    for ere_id in deepcopy(seen_eres):
-        if graph_mix.eres[ere_id].category in ['Event', 'Relation']:
-            reachable_stmts.update(graph_mix.eres[ere_id].stmt_ids)
-            seen_eres.update(graph_mix.eres[ere_id].neighbor_ere_ids)
+    for ere_id in seen_eres.copy():
+        ere = eres[ere_id]
+        if ere.category in ['Event', 'Relation']:
+            reachable_stmts.update(ere.stmt_ids)
+            seen_eres.update(ere.neighbor_ere_ids)
+
+    eres_to_keep = seen_eres | st_tree_eres
 
     # Make sure we add all typing stmts for reachable EREs.
-    reachable_stmts.update(set.union(*[{item for item in graph_mix.eres[ere_id].stmt_ids if not graph_mix.stmts[item].tail_id} for ere_id in set.union(seen_eres, st_tree_eres)]))
+    for ere_id in eres_to_keep:
+        for stmt_id in eres[ere_id].stmt_ids:
+            if not stmts[stmt_id].tail_id:
+                reachable_stmts.add(stmt_id)
+
+    stmts_to_keep = reachable_stmts | st_tree_stmts
 
     # Remove all non-reached EREs.
-    for ere_id in set(graph_mix.eres.keys()) - set.union(seen_eres, st_tree_eres):
-        del graph_mix.eres[ere_id]
+    graph_mix.eres = {ere_id: ere for ere_id, ere in eres.items() if ere_id in eres_to_keep}
 
     # Remove all non-reached stmts.
-    for stmt_id in set(graph_mix.stmts.keys()) - set.union(reachable_stmts, st_tree_stmts):
-        del graph_mix.stmts[stmt_id]
+    graph_mix.stmts = {stmt_id: stmt for stmt_id, stmt in stmts.items() if stmt_id in stmts_to_keep}
 
     # Update each reachable ERE's neighbor EREs and adjacent stmts sets.
-    for ere_id in graph_mix.eres.keys():
-        graph_mix.eres[ere_id].stmt_ids = set.intersection(graph_mix.eres[ere_id].stmt_ids, set.union(reachable_stmts, st_tree_stmts))
-        graph_mix.eres[ere_id].neighbor_ere_ids = set.union(*[{graph_mix.stmts[item].head_id, graph_mix.stmts[item].tail_id} for item in graph_mix.eres[ere_id].stmt_ids if graph_mix.stmts[item].tail_id]) - {ere_id}
+    stmts = graph_mix.stmts
+
+    for ere_id, ere in graph_mix.eres.items():
+        ere.stmt_ids = ere.stmt_ids & stmts_to_keep
+
+        neighbor_ere_ids = set()
+
+        for stmt_id in ere.stmt_ids:
+            stmt = stmts[stmt_id]
+
+            if stmt.tail_id:
+                neighbor_ere_ids.add(stmt.head_id)
+                neighbor_ere_ids.add(stmt.tail_id)
+
+        neighbor_ere_ids.discard(ere_id)
+        ere.neighbor_ere_ids = neighbor_ere_ids
 
     after_merge_points = {item for item in graph_mix.eres.keys() if len({graph_mix.stmts[stmt_id].graph_id for stmt_id in graph_mix.eres[item].stmt_ids}) > 1}
 
     assert before_merge_points == after_merge_points
 
+# Given one set of (ere_id, two-step connectedness) candidates per source graph, find the combination (one candidate per source graph) with the
+# highest total two-step connectedness not exceeding <max_connectedness_two_step> (if specified); returns None if no such combination exists.
+# This is a pruned depth-first search, which avoids materializing the full Cartesian product of candidates.
+def get_best_merge_combination(candidate_sets, max_connectedness_two_step):
+    candidate_lists = [sorted(candidates, key=lambda x: x[1], reverse=True) for candidates in candidate_sets]
+
+    if not all(candidate_lists):
+        return None
+
+    # <max_rest[i]>/<min_rest[i]>: the largest/smallest total connectedness achievable by the source graphs from index i onward
+    max_rest = [0] * (len(candidate_lists) + 1)
+    min_rest = [0] * (len(candidate_lists) + 1)
+
+    for i in range(len(candidate_lists) - 1, -1, -1):
+        max_rest[i] = max_rest[i + 1] + candidate_lists[i][0][1]
+        min_rest[i] = min_rest[i + 1] + candidate_lists[i][-1][1]
+
+    best = [None, -1]
+    partial_comb = []
+
+    def search(i, partial_sum):
+        if i == len(candidate_lists):
+            if partial_sum > best[1]:
+                best[0] = tuple(partial_comb)
+                best[1] = partial_sum
+            return
+
+        for candidate in candidate_lists[i]:
+            total = partial_sum + candidate[1]
+
+            # Candidates are sorted in descending order, so no remaining candidate can beat the current best
+            if total + max_rest[i + 1] <= best[1]:
+                break
+
+            # Even the least connected completion would exceed the maximum; try a less connected candidate
+            if max_connectedness_two_step and total + min_rest[i + 1] > max_connectedness_two_step:
+                continue
+
+            partial_comb.append(candidate)
+            search(i + 1, total)
+            partial_comb.pop()
+
+    search(0, 0)
+
+    return best[0]
+
+# Map each name in <name_map> to a dictionary keyed by source graph ID, holding the list of (ere_id, two-step connectedness) tuples
+# for the EREs with that name in that source graph
+def index_name_map(name_map, two_step_connectedness_map, ere_to_graph):
+    name_graph_eres = dict()
+
+    for name, ere_ids in name_map.items():
+        graph_eres = defaultdict(list)
+
+        for ere_id in ere_ids:
+            graph_eres[ere_to_graph[ere_id]].append((ere_id, two_step_connectedness_map[ere_id]))
+
+        name_graph_eres[name] = dict(graph_eres)
+
+    return name_graph_eres
+
 # Get combinations of highly connected mergeable EREs from the chosen source graphs
-def get_query_points(sample_graphs, name_dict, src_to_name_map, num_sources, two_step_connectedness_map, max_connectedness_two_step, ere_type_maps):
+# <name_graph_eres> is the output of index_name_map() for the name map the candidates are drawn from
+def get_query_points(sample_graphs, name_graph_eres, src_to_name_map, num_sources, max_connectedness_two_step, ere_type_maps):
     # Determine all ERE names which the chosen source graphs share
     shared_names = set.intersection(*[src_to_name_map[item] for item in sample_graphs])
-    name_to_ere_dict = defaultdict(lambda: defaultdict(set))
-
-    # Create a dictionary mapping <source graph> and <name> keys to a list of (ere_id, two-step connectedness) tuples
-    for name in shared_names:
-        for ere_id in name_dict[name]:
-            if ere_id.split('_h')[0] in sample_graphs:
-                name_to_ere_dict[ere_id.split('_h')[0]][name].add((ere_id, two_step_connectedness_map[ere_id]))
 
-    merge_comb_dict = dict()
-    ranked_dict = dict()
     super_ranked_list = []
 
     for name in shared_names:
-        # Determine all possible combinations of mergeable EREs with a particular name for the set of chosen source graphs
-        merge_comb_dict[name] = set(itertools.product(*[name_to_ere_dict[graph_id][name] for graph_id in sample_graphs]))
+        graph_eres = name_graph_eres[name]
 
-        # Ensure the total connectedness of all merge candidates does not exceed the specified maximum (if any)
-        if max_connectedness_two_step:
-            merge_comb_dict[name] = {item for item in merge_comb_dict[name] if sum([sub_item[1] for sub_item in item]) <= max_connectedness_two_step}
+        # Find the most highly connected (two-step) combination of mergeable EREs with the current name across the chosen source graphs
+        best_comb = get_best_merge_combination([graph_eres[graph_id] for graph_id in sample_graphs], max_connectedness_two_step)
 
-        if len(merge_comb_dict[name]) > 0:
-            # Rank each combination of mergeable candidates by their total two-step connectedness for the current name
-            ranked_dict[name] = sorted(list(merge_comb_dict[name]), key=lambda x: sum([item[1] for item in x]), reverse=True)
+        if best_comb is not None:
             # Add the most highly connected (two-step) combination for the current name to a master list
-            super_ranked_list.append((name, ranked_dict[name][0]))
+            super_ranked_list.append((name, best_comb))
 
     # Globally rank each selected combination of merge candidates across all shared event names
     super_ranked_list = sorted(super_ranked_list, key=lambda x: sum([item[1] for item in x[1]]), reverse=True)
@@ -194,18 +358,17 @@ def get_query_points(sample_graphs, name_dict, src_to_name_map, num_sources, two
     return query_points
 
 # Determine the set of component graphs for each the event query points are mutually reachable via only statements from each component graph.
-def get_possible_target_graph_ids(graph_list, sample_graphs, query_points):
+# <component_maps> maps each source graph ID to its ERE connected component labels, and <root_components> to the label of its first query point.
+def get_possible_target_graph_ids(component_maps, root_components, sample_graphs, query_points):
     poss_target_graph_ids = []
 
     for graph_iter, graph_id in enumerate(sample_graphs):
-        root_ere_id = query_points[0][1][graph_iter][0]
-
         reach = True
 
         count = query_points[0][1][graph_iter][1]
 
         for name_iter in range(1, len(query_points)):
-            if not reachable(graph_list[graph_id], root_ere_id, query_points[name_iter][1][graph_iter][0]):
+            if component_maps[graph_id][query_points[name_iter][1][graph_iter][0]] != root_components[graph_id]:
                 reach = False
                 break
             else:
@@ -217,7 +380,7 @@ def get_possible_target_graph_ids(graph_list, sample_graphs, query_points):
     return poss_target_graph_ids
 
 def create_noisy_merge_points(graph_mix, graph_list, sample_graphs, merge_ere_map, used_eres, target_graph_id, num_total_merge_points, num_noisy_sources, num_noisy_events, num_noisy_entities, noisy_event_names, noisy_entity_names,
-                                  noisy_event_src_to_name_map, noisy_entity_src_to_name_map):
+                                  noisy_event_src_to_name_map, noisy_entity_src_to_name_map, ere_to_graph):
     merge_points = {item for item in graph_mix.eres.keys() if len({graph_mix.stmts[stmt_id].graph_id for stmt_id in graph_mix.eres[item].stmt_ids}) > 1}
 
     num_noisy_merge_points = 0
@@ -229,17 +392,17 @@ def create_noisy_merge_points(graph_mix, graph_list, sample_graphs, merge_ere_ma
         while (len(poss_names) > 0) and ((num_total_merge_points == -1) or (num_merge_point_count == -1) or (num_noisy_merge_points < num_total_merge_points - len(merge_points))):
             name = random.choice(list(poss_names))
 
-            ere_ids = {ere_id for ere_id in name_map[name] if ere_id.split('_h')[0] not in (set(sample_graphs) - {target_graph_id})} - used_eres
-            ere_ids = {ere_id for ere_id in ere_ids if (ere_id.split('_h')[0] != target_graph_id) or (ere_id in graph_mix.eres.keys())}
+            ere_ids = {ere_id for ere_id in name_map[name] if ere_to_graph[ere_id] not in (set(sample_graphs) - {target_graph_id})} - used_eres
+            ere_ids = {ere_id for ere_id in ere_ids if (ere_to_graph[ere_id] != target_graph_id) or (ere_id in graph_mix.eres.keys())}
 
-            graph_ids = {ere_id.split('_h')[0] for ere_id in ere_ids}
+            graph_ids = {ere_to_graph[ere_id] for ere_id in ere_ids}
 
             if target_graph_id in graph_ids and len(graph_ids) >= num_noisy_sources:
-                target_ere_id = random.choice([item for item in ere_ids if item.split('_h')[0] == target_graph_id])
-                other_graph_ids = random.sample((graph_ids - {target_graph_id}), (num_noisy_sources - 1))
+                target_ere_id = random.choice([item for item in ere_ids if ere_to_graph[item] == target_graph_id])
+                other_graph_ids = random.sample(list(graph_ids - {target_graph_id}), (num_noisy_sources - 1))
 
                 for graph_id in other_graph_ids:
-                    other_ere_id = random.choice([item for item in ere_ids if item.split('_h')[0] == graph_id])
+                    other_ere_id = random.choice([item for item in ere_ids if ere_to_graph[item] == graph_id])
 
                     merge_ere_map[other_ere_id] = target_ere_id
                     noisy_merge_ere_map[other_ere_id] = target_ere_id
@@ -252,13 +415,13 @@ def create_noisy_merge_points(graph_mix, graph_list, sample_graphs, merge_ere_ma
             else:
                 poss_names.discard(name)
 
-    other_graph_ids = {ere_id.split('_h')[0] for ere_id in noisy_merge_ere_map.keys()}
+    other_graph_ids = {ere_to_graph[ere_id] for ere_id in noisy_merge_ere_map.keys()}
 
     for other_graph_id in other_graph_ids:
-        other_graph = deepcopy(graph_list[other_graph_id])
+        other_graph = clone_graph(graph_list[other_graph_id])
         stmts_to_keep = set()
 
-        for other_ere_id in [item for item in noisy_merge_ere_map.keys() if item.split('_h')[0] == other_graph_id]:
+        for other_ere_id in [item for item in noisy_merge_ere_map.keys() if ere_to_graph[item] == other_graph_id]:
             other_ere = other_graph.eres[other_ere_id]
 
             for stmt_id in [sub_item for sub_item in other_ere.stmt_ids if other_graph.stmts[sub_item].tail_id]:
@@ -283,12 +446,12 @@ def create_noisy_merge_points(graph_mix, graph_list, sample_graphs, merge_ere_ma
                 graph_mix.eres[noisy_merge_ere_map[ere_id]].neighbor_ere_ids.update({(item if item not in noisy_merge_ere_map.keys() else noisy_merge_ere_map[item]) for item in other_graph.eres[ere_id].neighbor_ere_ids} -
                                                                                     {noisy_merge_ere_map[ere_id]})
             else:
-                graph_mix.eres[ere_id] = deepcopy(other_graph.eres[ere_id])
+                graph_mix.eres[ere_id] = clone_ere(other_graph.eres[ere_id])
 
                 graph_mix.eres[ere_id].neighbor_ere_ids = {(item if item not in noisy_merge_ere_map.keys() else noisy_merge_ere_map[item]) for item in graph_mix.eres[ere_id].neighbor_ere_ids}
 
         for stmt_id in stmts_to_keep:
-            graph_mix.stmts[stmt_id] = deepcopy(other_graph.stmts[stmt_id])
+            graph_mix.stmts[stmt_id] = clone_stmt(other_graph.stmts[stmt_id])
 
             if other_graph.stmts[stmt_id].head_id in noisy_merge_ere_map.keys():
                 graph_mix.stmts[stmt_id].head_id = noisy_merge_ere_map[other_graph.stmts[stmt_id].head_id]
@@ -298,68 +461,74 @@ def create_noisy_merge_points(graph_mix, graph_list, sample_graphs, merge_ere_ma
 
 # This function creates a graph salad by mixing a set of single-doc graphs at <num_shared_eres> or more points.
 def create_mix(graph_list, event_names, entity_names, noisy_event_names, noisy_entity_names, event_type_maps, entity_type_maps, one_step_connectedness_map, two_step_connectedness_map, max_connectedness_two_step, event_src_to_name_map, entity_src_to_name_map,
-                                           noisy_event_src_to_name_map, noisy_entity_src_to_name_map, event_name_counts, entity_name_counts, num_sources, num_shared_eres, num_total_merge_points, num_noisy_sources, num_noisy_events, num_noisy_entities, num_abridge_hops, used_pairs):
+                                           noisy_event_src_to_name_map, noisy_entity_src_to_name_map, event_name_counts, entity_name_counts, num_sources, num_shared_eres, num_total_merge_points, num_noisy_sources, num_noisy_events, num_noisy_entities, num_abridge_hops, used_pairs,
+                                           ere_to_graph, event_name_graph_eres, entity_name_graph_eres, component_maps):
     # Determine all event names which are found in <num_sources> or more source docs
-    mixable_events = dict({key: value for (key, value) in event_name_counts if value >= num_sources})
+    mixable_events = [key for (key, value) in event_name_counts if value >= num_sources]
+
+    # Lists of ERE IDs for each sampled event name (random.sample requires a sequence)
+    poss_ere_lists = dict()
 
     done = False
 
     while not done:
         # Sample a random event name from those which are found in <num_sources> or more source graphs
-        event_name = random.sample(list(mixable_events.keys()), 1)[0]
-        poss_eres = event_names[event_name]
+        event_name = random.choice(mixable_events)
+
+        if event_name not in poss_ere_lists:
+            poss_ere_lists[event_name] = list(event_names[event_name])
+
+        poss_eres = poss_ere_lists[event_name]
 
         # Sample three ERE IDs from the set associated with the chosen event name;
         # the three sources from which these EREs come will be the source graphs used to create the salad
         sample_eres = random.sample(poss_eres, num_sources)
-        sample_graphs = [item.split('_h')[0] for item in sample_eres]
+        sample_graphs = [ere_to_graph[item] for item in sample_eres]
 
         # Ensure that (i) all source graphs from which the chosen EREs are drawn are in the allowed (train, val, test) subset of sources and
         #             (ii) the three EREs chosen are from three distinct source graphs
-        if (set(sample_graphs) - set(graph_list.keys())) or (len(set(sample_graphs)) < num_sources):
+        if (set(sample_graphs) - graph_list.keys()) or (len(set(sample_graphs)) < num_sources):
             continue
 
         # Get possible combinations of EREs for query points
-        query_event_points = get_query_points(sample_graphs, event_names, event_src_to_name_map, num_sources, two_step_connectedness_map, max_connectedness_two_step, event_type_maps)
-        query_entity_points = get_query_points(sample_graphs, entity_names, entity_src_to_name_map, num_sources, two_step_connectedness_map, max_connectedness_two_step, entity_type_maps)
+        query_event_points = get_query_points(sample_graphs, event_name_graph_eres, event_src_to_name_map, num_sources, max_connectedness_two_step, event_type_maps)
+        query_entity_points = get_query_points(sample_graphs, entity_name_graph_eres, entity_src_to_name_map, num_sources, max_connectedness_two_step, entity_type_maps)
 
         if len(query_event_points) < num_shared_eres:
             continue
 
+        # An ERE is reachable from the first event query point iff it lies in the same connected component (see component_map())
+        root_components = {graph_id: component_maps[graph_id][query_event_points[0][1][graph_iter][0]] for graph_iter, graph_id in enumerate(sample_graphs)}
+
         # Determine which source graphs can serve as target graphs in separate instances (given the reachability constraint)
-        poss_target_graph_ids = get_possible_target_graph_ids(graph_list, sample_graphs, query_event_points[:num_shared_eres])
+        poss_target_graph_ids = get_possible_target_graph_ids(component_maps, root_components, sample_graphs, query_event_points[:num_shared_eres])
 
         if len(poss_target_graph_ids) == 0:
             continue
 
         # Ensure that at least one of these salad instances has not previously been created
-        target_graph_ids = [item[1] for item in poss_target_graph_ids]
-        source_graph_ids_w_targets = {(frozenset(sample_graphs), item) for item in target_graph_ids}
+        source_graph_ids = frozenset(sample_graphs)
+        new_poss_target_graph_ids = [item for item in poss_target_graph_ids if (source_graph_ids, item[1]) not in used_pairs]
 
-        if source_graph_ids_w_targets - used_pairs:
+        if new_poss_target_graph_ids:
             done = True
 
             # Filter out all salad-target instances that have been previously created
-            new_salad_targets = [item[1] for item in source_graph_ids_w_targets - used_pairs]
-            poss_target_graph_ids = [item for item in poss_target_graph_ids if item[1] in new_salad_targets]
+            poss_target_graph_ids = new_poss_target_graph_ids
 
     # Find all potential entity merge points which are reachable from the event merge points
     reachable_ents = defaultdict(set)
 
     for graph_iter, graph_id in [(item[0], item[1]) for item in poss_target_graph_ids]:
-        root_ere_id = query_event_points[0][1][graph_iter][0]
-
         for name_iter in range(len(query_entity_points)):
-            if reachable(graph_list[graph_id], root_ere_id, query_entity_points[name_iter][1][graph_iter][0]):
+            if component_maps[graph_id][query_entity_points[name_iter][1][graph_iter][0]] == root_components[graph_id]:
                 reachable_ents[graph_id].add(name_iter)
 
     other_reachable_events = defaultdict(set)
 
     for graph_iter, graph_id in [(item[0], item[1]) for item in poss_target_graph_ids]:
-        root_ere_id = query_event_points[0][1][graph_iter][0]
-
         for name_iter in range(num_shared_eres, len(query_event_points)):
-            if reachable(graph_list[graph_id], root_ere_id, query_event_points[name_iter][1][graph_iter][0]):
+            if component_maps[graph_id][query_event_points[name_iter][1][graph_iter][0]] == root_components[graph_id]:
                 other_reachable_events[graph_id].add(name_iter)
 
     # Mix the source graphs and create the salads
@@ -367,10 +536,10 @@ def create_mix(graph_list, event_names, entity_names, noisy_event_names, noisy_e
 
     # For each of the valid target graphs
     for (target_graph_iter, target_graph_id, count) in poss_target_graph_ids:
-        graph_copies = [deepcopy(graph_list[item]) for item in sample_graphs]
+        graph_copies = [clone_graph(graph) for graph in (graph_list[item] for item in sample_graphs)]
 
         # Randomly choose one of the event merge points (the "origin ID") to construct the query set
-        random_start_ind = random.sample(range(num_shared_eres), 1)[0]
+        random_start_ind = random.randrange(num_shared_eres)
 
         for point_iter, (name, ere_info) in enumerate(query_event_points[:num_shared_eres]):
             target_ere_id = ere_info[target_graph_iter][0]
@@ -412,39 +581,45 @@ def create_mix(graph_list, event_names, entity_names, noisy_event_names, noisy_e
 
         # Fetch the ERE in the target graph for each merge point
         for ere_id in mix_point_ere_ids:
-            graph_mix.eres[ere_id] = deepcopy(graph_copies[target_graph_iter].eres[ere_id])
+            graph_mix.eres[ere_id] = clone_ere(graph_copies[target_graph_iter].eres[ere_id])
 
         # Merge selected EREs and add subgraphs surrounding merge points from each component graph
         for graph in graph_copies:
-            eres_to_update = set()
-            stmts_to_update = set()
+            eres = graph.eres
+            stmts = graph.stmts
+            mix_eres = graph_mix.eres
+            mix_stmts = graph_mix.stmts
+
+            target_ids = set()
 
-            init_stmts = set.union(*[set(graph.eres[mix_point_ere_id].stmt_ids) for mix_point_ere_id in mix_point_ere_ids])
-            stmts_to_update.update(init_stmts)
+            for mix_point_ere_id in mix_point_ere_ids:
+                mix_point_ere = eres[mix_point_ere_id]
+                mix_stmts.update({stmt_id: stmts[stmt_id] for stmt_id in mix_point_ere.stmt_ids})
+                target_ids.update(mix_point_ere.neighbor_ere_ids)
 
-            target_ids = set.union(*[set(graph.eres[mix_point_ere_id].neighbor_ere_ids) for mix_point_ere_id in mix_point_ere_ids])
-            target_ids = list(target_ids - mix_point_ere_ids)
+            target_ids.difference_update(mix_point_ere_ids)
             seen_eres = mix_point_ere_ids.copy()
 
-            while len(target_ids) > 0:
-                new_target_set = set()
+            # Traverse the subgraph reachable from the merge points, adding each visited ERE (and its stmts) to the mixture as we go
+            while target_ids:
+                new_target_ids = set()
+
                 for target_id in target_ids:
-                    if target_id not in mix_point_ere_ids:
-                        eres_to_update.add(target_id)
-                    seen_eres.add(target_id)
+                    target_ere = eres[target_id]
 
-                    stmts_to_update.update(graph.eres[target_id].stmt_ids)
+                    mix_eres[target_id] = target_ere
+                    mix_stmts.update({stmt_id: stmts[stmt_id] for stmt_id in target_ere.stmt_ids})
 
-                    new_target_set.update(graph.eres[target_id].neighbor_ere_ids)
-                new_target_set -= seen_eres
-                target_ids = list(new_target_set)
+                    new_target_ids.update(target_ere.neighbor_ere_ids)
 
-            graph_mix.eres.update({ere_id: graph.eres[ere_id] for ere_id in eres_to_update})
-            graph_mix.stmts.update({stmt_id: graph.stmts[stmt_id] for stmt_id in stmts_to_update})
+                seen_eres.update(target_ids)
+                new_target_ids.difference_update(seen_eres)
+                target_ids = new_target_ids
 
             for ere_id in mix_point_ere_ids:
-                graph_mix.eres[ere_id].neighbor_ere_ids.update(graph.eres[ere_id].neighbor_ere_ids)
-                graph_mix.eres[ere_id].stmt_ids.update(graph.eres[ere_id].stmt_ids)
+                mix_ere = mix_eres[ere_id]
+                mix_ere.neighbor_ere_ids.update(eres[ere_id].neighbor_ere_ids)
+                mix_ere.stmt_ids.update(eres[ere_id].stmt_ids)
 
         # # Ensure that there are no duplicate type statements from different component graphs
         # for ere_id in mix_point_ere_ids:
@@ -467,23 +642,23 @@ def create_mix(graph_list, event_names, entity_names, noisy_event_names, noisy_e
         origin_id = query_event_points[random_start_ind][1][target_graph_iter][0]
 
         # Graph cleanup
-        for ere_id in graph_mix.eres.keys():
-            graph_mix.eres[ere_id].stmt_ids.update({item for item in graph_mix.stmts.keys() if ere_id in {graph_mix.stmts[item].head_id, graph_mix.stmts[item].tail_id}})
-            graph_mix.eres[ere_id].neighbor_ere_ids = set.union(*[{graph_mix.stmts[item].head_id, graph_mix.stmts[item].tail_id} for item in graph_mix.eres[ere_id].stmt_ids if graph_mix.stmts[item].tail_id]) - {ere_id}
+        ere_to_stmts, ere_to_neighbors = index_stmts(graph_mix)
 
-        # For all merge points, remove all non-target typing statements
         for ere_id, ere in graph_mix.eres.items():
-            items_to_del = set()
+            ere.stmt_ids.update(ere_to_stmts[ere_id])
+            ere.neighbor_ere_ids = ere_to_neighbors[ere_id] - {ere_id}
 
-            if len({graph_mix.stmts[item].graph_id for item in ere.stmt_ids if not graph_mix.stmts[item].tail_id}) > 1:
-                for item in ere.stmt_ids:
-                    if (not graph_mix.stmts[item].tail_id) and (graph_mix.stmts[item].graph_id != target_graph_id):
-                        items_to_del.add(item)
+        # For all merge points, remove all non-target typing statements
+        stmts = graph_mix.stmts
 
-            for item in items_to_del:
-                del graph_mix.stmts[item]
+        for ere in graph_mix.eres.values():
+            type_stmt_ids = [item for item in ere.stmt_ids if not stmts[item].tail_id]
 
-                graph_mix.eres[ere_id].stmt_ids.discard(item)
+            if len({stmts[item].graph_id for item in type_stmt_ids}) > 1:
+                for item in type_stmt_ids:
+                    if stmts[item].graph_id != target_graph_id:
+                        del stmts[item]
+                        ere.stmt_ids.discard(item)
 
         # If requested, reduce the size of the graph by cropping subgraphs pieces more than <num_abridge_hops> away from any given event merge point
         if num_abridge_hops:
@@ -520,39 +695,39 @@ def create_mix(graph_list, event_names, entity_names, noisy_event_names, noisy_e
         #     print('Diff: ', (core_merge_points - set.union(other_event_points, other_entity_points)))
 
         create_noisy_merge_points(graph_mix, graph_list, sample_graphs, merge_ere_map, used_eres, target_graph_id, num_total_merge_points, num_noisy_sources, num_noisy_events, num_noisy_entities, noisy_event_names, noisy_entity_names,
-                                  noisy_event_src_to_name_map, noisy_entity_src_to_name_map)
+                                  noisy_event_src_to_name_map, noisy_entity_src_to_name_map, ere_to_graph)
 
         noisy_merge_points = {item for item in graph_mix.eres.keys() if len({graph_mix.stmts[stmt_id].graph_id for stmt_id in graph_mix.eres[item].stmt_ids}) > 1} - core_merge_points
         noisy_event_merge_points = {item for item in noisy_merge_points if graph_mix.eres[item].category == 'Event'}
         noisy_entity_merge_points = {item for item in noisy_merge_points if graph_mix.eres[item].category == 'Entity'}
 
-        # Some sanity checks to make sure we accounted for structural rules.
-        for stmt_id, stmt in graph_mix.stmts.items():
-            head_id = stmt.head_id
-            tail_id = stmt.tail_id
-
-            if not tail_id:
-                assert stmt_id in graph_mix.eres[head_id].stmt_ids
-            else:
-                assert stmt_id in graph_mix.eres[head_id].stmt_ids
-                assert stmt_id in graph_mix.eres[tail_id].stmt_ids
-                assert tail_id in graph_mix.eres[head_id].neighbor_ere_ids
-                assert head_id in graph_mix.eres[tail_id].neighbor_ere_ids
+        # Some sanity checks to make sure we accounted for structural rules; the per-stmt checks are linear in the salad size,
+        # so they always run (unless assertions are disabled).
+        if __debug__:
+            for stmt_id, stmt in graph_mix.stmts.items():
+                head_id = stmt.head_id
+                tail_id = stmt.tail_id
 
-        for ere_id, ere in graph_mix.eres.items():
-            assert ere_id not in ere.neighbor_ere_ids
+                if not tail_id:
+                    assert stmt_id in graph_mix.eres[head_id].stmt_ids
+                else:
+                    assert stmt_id in graph_mix.eres[head_id].stmt_ids
+                    assert stmt_id in graph_mix.eres[tail_id].stmt_ids
+                    assert tail_id in graph_mix.eres[head_id].neighbor_ere_ids
+                    assert head_id in graph_mix.eres[tail_id].neighbor_ere_ids
 
-            assert len({graph_mix.stmts[item].graph_id for item in ere.stmt_ids if not graph_mix.stmts[item].tail_id}) == 1
-            assert graph_mix.stmts[[item for item in ere.stmt_ids if not graph_mix.stmts[item].tail_id][0]].graph_id == ere.graph_id
-            assert set.union(*[{graph_mix.stmts[stmt_id].head_id, graph_mix.stmts[stmt_id].tail_id} if graph_mix.stmts[stmt_id].tail_id else {graph_mix.stmts[stmt_id].head_id} for stmt_id in ere.stmt_ids]) - {ere_id} == ere.neighbor_ere_ids
+        # The per-ERE checks scan every stmt of every ERE, so they only run when VALIDATE_SALADS is enabled (e.g., when debugging).
+        if __debug__ and VALIDATE_SALADS:
+            ere_to_stmts, _ = index_stmts(graph_mix)
 
-            temp = set()
+            for ere_id, ere in graph_mix.eres.items():
+                assert ere_id not in ere.neighbor_ere_ids
 
-            for stmt_id, stmt in graph_mix.stmts.items():
-                if ere_id in [stmt.head_id, stmt.tail_id]:
-                    temp.add(stmt_id)
+                assert len({graph_mix.stmts[item].graph_id for item in ere.stmt_ids if not graph_mix.stmts[item].tail_id}) == 1
+                assert graph_mix.stmts[[item for item in ere.stmt_ids if not graph_mix.stmts[item].tail_id][0]].graph_id == ere.graph_id
+                assert set.union(*[{graph_mix.stmts[stmt_id].head_id, graph_mix.stmts[stmt_id].tail_id} if graph_mix.stmts[stmt_id].tail_id else {graph_mix.stmts[stmt_id].head_id} for stmt_id in ere.stmt_ids]) - {ere_id} == ere.neighbor_ere_ids
 
-            assert temp == ere.stmt_ids
+                assert ere_to_stmts[ere_id] == ere.stmt_ids
 
         # if len(noisy_merge_points) + 3 + len(other_reachable_events[target_graph_id]) + len(reachable_ents[target_graph_id]) > 10:
         #     print(noisy_merge_points, other_reachable_events[target_graph_id], reachable_ents[target_graph_id], noisy_event_merge_points, noisy_entity_merge_points)
@@ -568,51 +743,100 @@ def create_mix(graph_list, event_names, entity_names, noisy_event_names, noisy_e
 
     return graph_info, sample_graphs
 
+# Load a single pickled graph, returning it along with its graph ID
+def load_graph(graph_file):
+    with open(graph_file, 'rb') as f:
+        return str(graph_file).split('.p')[0].split('/')[-1], dill.load(f)
+
+# Load a pickled map (plain dicts/sets of strings and ints), reading it through a memory map; stdlib pickle is much faster
+# than dill for such payloads, and dill is only used as a fallback for pickles which rely on dill-specific types
+def load_map(map_file):
+    with open(map_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        try:
+            return pickle.loads(buf)
+        except (pickle.UnpicklingError, AttributeError, ImportError):
+            return dill.loads(buf)
+
+# Intern every ERE/stmt ID (and source graph ID) in <graph>, so that equal IDs share a single string object and the
+# dict/set lookups made while traversing the graph can short-circuit on identity
+def intern_ids(graph):
+    intern = sys.intern
+
+    graph.graph_id = intern(graph.graph_id)
+
+    for ere in graph.eres.values():
+        ere.graph_id = intern(ere.graph_id)
+        ere.id = intern(ere.id)
+        ere.neighbor_ere_ids = {intern(ere_id) for ere_id in ere.neighbor_ere_ids}
+        ere.stmt_ids = {intern(stmt_id) for stmt_id in ere.stmt_ids}
+
+    for stmt in graph.stmts.values():
+        stmt.graph_id = intern(stmt.graph_id)
+        stmt.id = intern(stmt.id)
+        stmt.head_id = intern(stmt.head_id)
+        if stmt.tail_id is not None:
+            stmt.tail_id = intern(stmt.tail_id)
+        stmt.dup_ids = {intern(stmt_id) for stmt_id in stmt.dup_ids}
+
+    graph.eres = {intern(ere_id): ere for ere_id, ere in graph.eres.items()}
+    graph.stmts = {intern(stmt_id): stmt for stmt_id, stmt in graph.stmts.items()}
+
 # This function pre-loads all pickled graphs in the given folder
 def load_all_graphs_in_folder(graph_folder):
     print('Loading all graphs in {}...'.format(graph_folder))
 
     graph_file_list = sorted([f for f in Path(graph_folder).iterdir() if f.is_file()])
 
-    graph_list = dict()
+    graph_list = dict(load_graph(graph_file) for graph_file in tqdm(graph_file_list))
 
-    for graph_file in tqdm(graph_file_list):
-        if graph_file.is_file():
-            graph_list[str(graph_file).split('.p')[0].split('/')[-1]] = dill.load(open(graph_file, 'rb'))
+    for graph in graph_list.values():
+        intern_ids(graph)
 
     return graph_list
 
-# Filter out names based on subset of source graphs assigned to train, val, test partitions
-def filter_names(names, graph_list):
-    keys_to_del = []
-
-    for key in names.keys():
-        eres_to_dis = set()
-
-        for ere_id in names[key]:
-            if ere_id.split('_h')[0] not in graph_list:
-                eres_to_dis.add(ere_id)
-
-        names[key] -= eres_to_dis
-
-        if len(names[key]) == 0:
-            keys_to_del.append(key)
-
-    for key in keys_to_del:
-        del names[key]
+# Split a name map into (train, val, test) name maps based on the subsets of source graphs assigned to each partition,
+# dropping names which have no EREs in a given partition
+def partition_names(name_map, train_graph_list, val_graph_list, test_graph_list, ere_to_graph):
+    train_name_map = dict()
+    val_name_map = dict()
+    test_name_map = dict()
+
+    for name, ere_ids in name_map.items():
+        train_ere_ids = set()
+        val_ere_ids = set()
+        test_ere_ids = set()
+
+        for ere_id in ere_ids:
+            graph_id = ere_to_graph[ere_id]
+
+            if graph_id in train_graph_list:
+                train_ere_ids.add(ere_id)
+            elif graph_id in val_graph_list:
+                val_ere_ids.add(ere_id)
+            elif graph_id in test_graph_list:
+                test_ere_ids.add(ere_id)
+
+        if train_ere_ids:
+            train_name_map[name] = train_ere_ids
+        if val_ere_ids:
+            val_name_map[name] = val_ere_ids
+        if test_ere_ids:
+            test_name_map[name] = test_ere_ids
+
+    return train_name_map, val_name_map, test_name_map
 
 # Sort through all event nodes, discarding those which do not fulfill the requirements to be candidates for merging.
 # Event node candidates for merging must have:
 # --At least one attached non-typing statement (by necessity, attached to an entity node)
 # --The given minimum one-step and two-step connectedness scores
-def filter_merge_candidates(ere_name_map, graph_list, one_step_connectedness_map, two_step_connectedness_map, min_connectedness_one_step, min_connectedness_two_step):
+def filter_merge_candidates(ere_name_map, graph_list, one_step_connectedness_map, two_step_connectedness_map, min_connectedness_one_step, min_connectedness_two_step, ere_to_graph):
     keys_to_del = []
 
     for key in ere_name_map.keys():
         eres_to_dis = []
 
         for ere_id in ere_name_map[key]:
-            graph = graph_list[ere_id.split('_h')[0]]
+            graph = graph_list[ere_to_graph[ere_id]]
 
             event_stmt_ids = {stmt_id for stmt_id in graph.eres[ere_id].stmt_ids if graph.stmts[stmt_id].tail_id and (graph.eres[graph.stmts[stmt_id].head_id].category == 'Event')}
 
@@ -640,25 +864,31 @@ def make_mixture_data(single_doc_graphs_folder, event_name_map, entity_name_map,
 
     graph_list = load_all_graphs_in_folder(single_doc_graphs_folder)
 
-    noisy_event_name_map = deepcopy(event_name_map)
-    noisy_entity_name_map = deepcopy(entity_name_map)
+    # Label the connected components of each source graph once up front (the source graphs are never mutated)
+    component_maps = {graph_id: component_map(graph) for graph_id, graph in graph_list.items()}
+
+    # Map each ERE ID to the ID of the source graph it belongs to (avoids re-parsing ERE ID strings)
+    ere_to_graph = {ere_id: graph_id for graph_id, graph in graph_list.items() for ere_id in graph.eres.keys()}
+
+    noisy_event_name_map = {name: ere_ids.copy() for name, ere_ids in event_name_map.items()}
+    noisy_entity_name_map = {name: ere_ids.copy() for name, ere_ids in entity_name_map.items()}
 
     # Filter out EREs which do not meet requirements for merging
-    filter_merge_candidates(event_name_map, graph_list, one_step_connectedness_map, two_step_connectedness_map, min_connectedness_one_step, min_connectedness_two_step)
-    filter_merge_candidates(entity_name_map, graph_list, one_step_connectedness_map, two_step_connectedness_map, min_connectedness_one_step, min_connectedness_two_step)
-    filter_merge_candidates(noisy_event_name_map, graph_list, one_step_connectedness_map, two_step_connectedness_map, noisy_min_connectedness_one_step, noisy_min_connectedness_two_step)
-    filter_merge_candidates(noisy_entity_name_map, graph_list, one_step_connectedness_map, two_step_connectedness_map, noisy_min_connectedness_one_step, noisy_min_connectedness_two_step)
+    filter_merge_candidates(event_name_map, graph_list, one_step_connectedness_map, two_step_connectedness_map, min_connectedness_one_step, min_connectedness_two_step, ere_to_graph)
+    filter_merge_candidates(entity_name_map, graph_list, one_step_connectedness_map, two_step_connectedness_map, min_connectedness_one_step, min_connectedness_two_step, ere_to_graph)
+    filter_merge_candidates(noisy_event_name_map, graph_list, one_step_connectedness_map, two_step_connectedness_map, noisy_min_connectedness_one_step, noisy_min_connectedness_two_step, ere_to_graph)
+    filter_merge_candidates(noisy_entity_name_map, graph_list, one_step_connectedness_map, two_step_connectedness_map, noisy_min_connectedness_one_step, noisy_min_connectedness_two_step, ere_to_graph)
 
     num_train_graphs = math.ceil(perc_train * len(graph_list))
     num_test_graphs = math.ceil(perc_test * len(graph_list))
 
-    unused_graphs = set(graph_list.keys())
+    # Randomly partition the source graphs with a single shuffle
+    shuffled_graphs = list(graph_list.keys())
+    random.shuffle(shuffled_graphs)
 
-    train_graph_list = set(random.sample(list(unused_graphs), num_train_graphs))
-    unused_graphs -= train_graph_list
-    test_graph_list = set(random.sample(list(unused_graphs), num_test_graphs))
-    unused_graphs -= test_graph_list
-    val_graph_list = unused_graphs
+    train_graph_list = set(shuffled_graphs[:num_train_graphs])
+    test_graph_list = set(shuffled_graphs[num_train_graphs:(num_train_graphs + num_test_graphs)])
+    val_graph_list = set(shuffled_graphs[(num_train_graphs + num_test_graphs):])
 
     assert not set.intersection(train_graph_list, val_graph_list)
     assert not set.intersection(train_graph_list, test_graph_list)
@@ -667,72 +897,48 @@ def make_mixture_data(single_doc_graphs_folder, event_name_map, entity_name_map,
     print(len(train_graph_list), len(val_graph_list), len(test_graph_list))
 
     # Assign subsets of source graphs for use in creating each of the (train, val, test) partitions.
-    train_event_name_map = deepcopy(event_name_map)
-    val_event_name_map = deepcopy(event_name_map)
-    test_event_name_map = deepcopy(event_name_map)
-
-    filter_names(train_event_name_map, train_graph_list)
-    filter_names(val_event_name_map, val_graph_list)
-    filter_names(test_event_name_map, test_graph_list)
+    train_event_name_map, val_event_name_map, test_event_name_map = partition_names(event_name_map, train_graph_list, val_graph_list, test_graph_list, ere_to_graph)
 
-    assert not set.intersection(set([item.split('_h')[0] for sublist in train_event_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in val_event_name_map.values() for item in sublist]))
-    assert not set.intersection(set([item.split('_h')[0] for sublist in train_event_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in test_event_name_map.values() for item in sublist]))
-    assert not set.intersection(set([item.split('_h')[0] for sublist in val_event_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in test_event_name_map.values() for item in sublist]))
+    assert not set.intersection(set([ere_to_graph[item] for sublist in train_event_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in val_event_name_map.values() for item in sublist]))
+    assert not set.intersection(set([ere_to_graph[item] for sublist in train_event_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in test_event_name_map.values() for item in sublist]))
+    assert not set.intersection(set([ere_to_graph[item] for sublist in val_event_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in test_event_name_map.values() for item in sublist]))
 
-    train_entity_name_map = deepcopy(entity_name_map)
-    val_entity_name_map = deepcopy(entity_name_map)
-    test_entity_name_map = deepcopy(entity_name_map)
+    train_entity_name_map, val_entity_name_map, test_entity_name_map = partition_names(entity_name_map, train_graph_list, val_graph_list, test_graph_list, ere_to_graph)
 
-    filter_names(train_entity_name_map, train_graph_list)
-    filter_names(val_entity_name_map, val_graph_list)
-    filter_names(test_entity_name_map, test_graph_list)
+    assert not set.intersection(set([ere_to_graph[item] for sublist in train_entity_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in val_entity_name_map.values() for item in sublist]))
+    assert not set.intersection(set([ere_to_graph[item] for sublist in train_entity_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in test_entity_name_map.values() for item in sublist]))
+    assert not set.intersection(set([ere_to_graph[item] for sublist in val_entity_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in test_entity_name_map.values() for item in sublist]))
 
-    assert not set.intersection(set([item.split('_h')[0] for sublist in train_entity_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in val_entity_name_map.values() for item in sublist]))
-    assert not set.intersection(set([item.split('_h')[0] for sublist in train_entity_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in test_entity_name_map.values() for item in sublist]))
-    assert not set.intersection(set([item.split('_h')[0] for sublist in val_entity_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in test_entity_name_map.values() for item in sublist]))
+    train_noisy_event_name_map, val_noisy_event_name_map, test_noisy_event_name_map = partition_names(noisy_event_name_map, train_graph_list, val_graph_list, test_graph_list, ere_to_graph)
 
-    train_noisy_event_name_map = deepcopy(noisy_event_name_map)
-    val_noisy_event_name_map = deepcopy(noisy_event_name_map)
-    test_noisy_event_name_map = deepcopy(noisy_event_name_map)
+    assert not set.intersection(set([ere_to_graph[item] for sublist in train_noisy_event_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in val_noisy_event_name_map.values() for item in sublist]))
+    assert not set.intersection(set([ere_to_graph[item] for sublist in train_noisy_event_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in test_noisy_event_name_map.values() for item in sublist]))
+    assert not set.intersection(set([ere_to_graph[item] for sublist in val_noisy_event_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in test_noisy_event_name_map.values() for item in sublist]))
 
-    filter_names(train_noisy_event_name_map, train_graph_list)
-    filter_names(val_noisy_event_name_map, val_graph_list)
-    filter_names(test_noisy_event_name_map, test_graph_list)
+    train_noisy_entity_name_map, val_noisy_entity_name_map, test_noisy_entity_name_map = partition_names(noisy_entity_name_map, train_graph_list, val_graph_list, test_graph_list, ere_to_graph)
 
-    assert not set.intersection(set([item.split('_h')[0] for sublist in train_noisy_event_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in val_noisy_event_name_map.values() for item in sublist]))
-    assert not set.intersection(set([item.split('_h')[0] for sublist in train_noisy_event_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in test_noisy_event_name_map.values() for item in sublist]))
-    assert not set.intersection(set([item.split('_h')[0] for sublist in val_noisy_event_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in test_noisy_event_name_map.values() for item in sublist]))
-
-    train_noisy_entity_name_map = deepcopy(noisy_entity_name_map)
-    val_noisy_entity_name_map = deepcopy(noisy_entity_name_map)
-    test_noisy_entity_name_map = deepcopy(noisy_entity_name_map)
-
-    filter_names(train_noisy_entity_name_map, train_graph_list)
-    filter_names(val_noisy_entity_name_map, val_graph_list)
-    filter_names(test_noisy_entity_name_map, test_graph_list)
-
-    assert not set.intersection(set([item.split('_h')[0] for sublist in train_noisy_entity_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in val_noisy_entity_name_map.values() for item in sublist]))
-    assert not set.intersection(set([item.split('_h')[0] for sublist in train_noisy_entity_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in test_noisy_entity_name_map.values() for item in sublist]))
-    assert not set.intersection(set([item.split('_h')[0] for sublist in val_noisy_entity_name_map.values() for item in sublist]), set([item.split('_h')[0] for sublist in test_noisy_entity_name_map.values() for item in sublist]))
+    assert not set.intersection(set([ere_to_graph[item] for sublist in train_noisy_entity_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in val_noisy_entity_name_map.values() for item in sublist]))
+    assert not set.intersection(set([ere_to_graph[item] for sublist in train_noisy_entity_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in test_noisy_entity_name_map.values() for item in sublist]))
+    assert not set.intersection(set([ere_to_graph[item] for sublist in val_noisy_entity_name_map.values() for item in sublist]), set([ere_to_graph[item] for sublist in test_noisy_entity_name_map.values() for item in sublist]))
 
     # Create lists of (ere_name, <num of sources containing ERE with ere_name>) tuples, sorted by num of sources
-    train_event_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in train_event_name_map[item]]))) for item in train_event_name_map.keys()], key=lambda x: x[1], reverse=True)
-    train_entity_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in train_entity_name_map[item]]))) for item in train_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
+    train_event_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in train_event_name_map[item]]))) for item in train_event_name_map.keys()], key=lambda x: x[1], reverse=True)
+    train_entity_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in train_entity_name_map[item]]))) for item in train_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
 
-    val_event_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in val_event_name_map[item]]))) for item in val_event_name_map.keys()], key=lambda x: x[1], reverse=True)
-    val_entity_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in val_entity_name_map[item]]))) for item in val_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
+    val_event_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in val_event_name_map[item]]))) for item in val_event_name_map.keys()], key=lambda x: x[1], reverse=True)
+    val_entity_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in val_entity_name_map[item]]))) for item in val_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
 
-    test_event_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in test_event_name_map[item]]))) for item in test_event_name_map.keys()], key=lambda x: x[1], reverse=True)
-    test_entity_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in test_entity_name_map[item]]))) for item in test_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
+    test_event_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in test_event_name_map[item]]))) for item in test_event_name_map.keys()], key=lambda x: x[1], reverse=True)
+    test_entity_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in test_entity_name_map[item]]))) for item in test_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
 
-    train_noisy_event_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in train_noisy_event_name_map[item]]))) for item in train_noisy_event_name_map.keys()], key=lambda x: x[1], reverse=True)
-    train_noisy_entity_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in train_noisy_entity_name_map[item]]))) for item in train_noisy_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
+    train_noisy_event_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in train_noisy_event_name_map[item]]))) for item in train_noisy_event_name_map.keys()], key=lambda x: x[1], reverse=True)
+    train_noisy_entity_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in train_noisy_entity_name_map[item]]))) for item in train_noisy_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
 
-    val_noisy_event_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in val_noisy_event_name_map[item]]))) for item in val_noisy_event_name_map.keys()], key=lambda x: x[1], reverse=True)
-    val_noisy_entity_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in val_noisy_entity_name_map[item]]))) for item in val_noisy_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
+    val_noisy_event_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in val_noisy_event_name_map[item]]))) for item in val_noisy_event_name_map.keys()], key=lambda x: x[1], reverse=True)
+    val_noisy_entity_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in val_noisy_entity_name_map[item]]))) for item in val_noisy_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
 
-    test_noisy_event_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in test_noisy_event_name_map[item]]))) for item in test_noisy_event_name_map.keys()], key=lambda x: x[1], reverse=True)
-    test_noisy_entity_name_counts = sorted([(item, len(set([ere_id.split('_h')[0] for ere_id in test_noisy_entity_name_map[item]]))) for item in test_noisy_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
+    test_noisy_event_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in test_noisy_event_name_map[item]]))) for item in test_noisy_event_name_map.keys()], key=lambda x: x[1], reverse=True)
+    test_noisy_entity_name_counts = sorted([(item, len(set([ere_to_graph[ere_id] for ere_id in test_noisy_entity_name_map[item]]))) for item in test_noisy_entity_name_map.keys()], key=lambda x: x[1], reverse=True)
 
     train_event_src_to_name_map = defaultdict(set)
     train_entity_src_to_name_map = defaultdict(set)
@@ -743,27 +949,27 @@ def make_mixture_data(single_doc_graphs_folder, event_name_map, entity_name_map,
 
     for key, item in train_event_name_map.items():
         for ere_id in item:
-            train_event_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            train_event_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     for key, item in train_entity_name_map.items():
         for ere_id in item:
-            train_entity_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            train_entity_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     for key, item in val_event_name_map.items():
         for ere_id in item:
-            val_event_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            val_event_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     for key, item in val_entity_name_map.items():
         for ere_id in item:
-            val_entity_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            val_entity_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     for key, item in test_event_name_map.items():
         for ere_id in item:
-            test_event_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            test_event_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     for key, item in test_entity_name_map.items():
         for ere_id in item:
-            test_entity_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            test_entity_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     train_noisy_event_src_to_name_map = defaultdict(set)
     train_noisy_entity_src_to_name_map = defaultdict(set)
@@ -774,27 +980,35 @@ def make_mixture_data(single_doc_graphs_folder, event_name_map, entity_name_map,
 
     for key, item in train_noisy_event_name_map.items():
         for ere_id in item:
-            train_noisy_event_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            train_noisy_event_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     for key, item in train_noisy_entity_name_map.items():
         for ere_id in item:
-            train_noisy_entity_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            train_noisy_entity_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     for key, item in val_noisy_event_name_map.items():
         for ere_id in item:
-            val_noisy_event_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            val_noisy_event_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     for key, item in val_noisy_entity_name_map.items():
         for ere_id in item:
-            val_noisy_entity_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            val_noisy_entity_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     for key, item in test_noisy_event_name_map.items():
         for ere_id in item:
-            test_noisy_event_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            test_noisy_event_src_to_name_map[ere_to_graph[ere_id]].add(key)
 
     for key, item in test_noisy_entity_name_map.items():
         for ere_id in item:
-            test_noisy_entity_src_to_name_map[ere_id.split('_h')[0]].add(key)
+            test_noisy_entity_src_to_name_map[ere_to_graph[ere_id]].add(key)
+
+    # Index each partition's candidate EREs by name and source graph once, rather than on every call to get_query_points()
+    train_event_name_graph_eres = index_name_map(train_event_name_map, two_step_connectedness_map, ere_to_graph)
+    train_entity_name_graph_eres = index_name_map(train_entity_name_map, two_step_connectedness_map, ere_to_graph)
+    val_event_name_graph_eres = index_name_map(val_event_name_map, two_step_connectedness_map, ere_to_graph)
+    val_entity_name_graph_eres = index_name_map(val_entity_name_map, two_step_connectedness_map, ere_to_graph)
+    test_event_name_graph_eres = index_name_map(test_event_name_map, two_step_connectedness_map, ere_to_graph)
+    test_entity_name_graph_eres = index_name_map(test_entity_name_map, two_step_connectedness_map, ere_to_graph)
 
     random.seed(1)
 
@@ -811,6 +1025,8 @@ def make_mixture_data(single_doc_graphs_folder, event_name_map, entity_name_map,
     entity_name_counts = train_entity_name_counts
     event_src_to_name_map = train_event_src_to_name_map
     entity_src_to_name_map = train_entity_src_to_name_map
+    event_name_graph_eres = train_event_name_graph_eres
+    entity_name_graph_eres = train_entity_name_graph_eres
 
     noisy_event_name_map = train_noisy_event_name_map
     noisy_entity_name_map = train_noisy_entity_name_map
@@ -831,6 +1047,8 @@ def make_mixture_data(single_doc_graphs_folder, event_name_map, entity_name_map,
             entity_name_counts = val_entity_name_counts
             event_src_to_name_map = val_event_src_to_name_map
             entity_src_to_name_map = val_entity_src_to_name_map
+            event_name_graph_eres = val_event_name_graph_eres
+            entity_name_graph_eres = val_entity_name_graph_eres
 
             noisy_event_name_map = val_noisy_event_name_map
             noisy_entity_name_map = val_noisy_entity_name_map
@@ -845,6 +1063,8 @@ def make_mixture_data(single_doc_graphs_folder, event_name_map, entity_name_map,
             entity_name_counts = test_entity_name_counts
             event_src_to_name_map = test_event_src_to_name_map
             entity_src_to_name_map = test_entity_src_to_name_map
+            event_name_graph_eres = test_event_name_graph_eres
+            entity_name_graph_eres = test_entity_name_graph_eres
 
             noisy_event_name_map = test_noisy_event_name_map
             noisy_entity_name_map = test_noisy_entity_name_map
@@ -855,10 +1075,12 @@ def make_mixture_data(single_doc_graphs_folder, event_name_map, entity_name_map,
 
         graph_info, used_graph_ids = create_mix(graph_list, event_name_map, entity_name_map, noisy_event_name_map, noisy_entity_name_map, event_type_maps, entity_type_maps, one_step_connectedness_map, two_step_connectedness_map,
                                                 max_connectedness_two_step, event_src_to_name_map, entity_src_to_name_map, noisy_event_src_to_name_map, noisy_entity_src_to_name_map, event_name_counts, entity_name_counts, num_sources, num_shared_eres,
-                                                num_total_merge_points, num_noisy_sources, num_noisy_events, num_noisy_entities, num_abridge_hops, used_pairs)
+                                                num_total_merge_points, num_noisy_sources, num_noisy_events, num_noisy_entities, num_abridge_hops, used_pairs, ere_to_graph,
+                                                event_name_graph_eres, entity_name_graph_eres, component_maps)
 
         # Used to ensure we don't create more than one salad with the same three source graphs
-        used_pairs.update([(frozenset(used_graph_ids), item[3]) for item in graph_info])
+        used_graph_ids_set = frozenset(used_graph_ids)
+        used_pairs.update((used_graph_ids_set, item[3]) for item in graph_info)
 
         for item in graph_info:
             origin_id, query, graph_mix, target_graph_id, noisy_merge_points, num_core_events, num_core_entities, num_noisy_event_points, num_noisy_entity_points = item
@@ -867,25 +1089,29 @@ def make_mixture_data(single_doc_graphs_folder, event_name_map, entity_name_map,
             if len(query) == 0:
                 continue
 
-            # Reject salads exceeding the maximum size (where max_size is in KB)
-            if len(dill.dumps(graph_mix, -1)) >= (814.433 * max_size):
-                continue
-
             # Reject mixtures containing no additional target graph statements to be extracted (i.e., the only target graph statements in the mixture are those found in the query)
             if len(set([stmt_id for stmt_id in graph_mix.stmts.keys() if graph_mix.stmts[stmt_id].graph_id == target_graph_id]) - set(query)) == 0:
                 continue
 
+            # Reject salads exceeding the maximum size (where max_size is in KB); the limit is applied to the serialized salad that
+            # gets written, which is the pickled graph mixture plus the origin/target IDs and the query and noisy merge point ID sets
+            # (a few hundred bytes at most, as their IDs are mostly memo references into the mixture)
+            buf = dill.dumps((origin_id, query, graph_mix, target_graph_id, noisy_merge_points), -1)
+
+            if len(buf) >= (814.433 * max_size):
+                continue
+
             file_name = '-'.join(used_graph_ids) + '_target-' + target_graph_id
 
             if counter < train_cut:
-                dill.dump((origin_id, query, graph_mix, target_graph_id, noisy_merge_points), open(os.path.join(out_data_dir, "Train", file_name) + '_' + str(num_core_events) + '_' + str(num_core_entities) + '_' + str(num_noisy_event_points)
-                        + '_' + str(num_noisy_entity_points) + ".p", "wb"))
+                split_dir = "Train"
             elif counter < val_cut:
-                dill.dump((origin_id, query, graph_mix, target_graph_id, noisy_merge_points), open(os.path.join(out_data_dir, "Val", file_name) + '_' + str(num_core_events) + '_' + str(num_core_entities) + '_' + str(num_noisy_event_points)
-                        + '_' + str(num_noisy_entity_points) + ".p", "wb"))
+                split_dir = "Val"
             else:
-                dill.dump((origin_id, query, graph_mix, target_graph_id, noisy_merge_points), open(os.path.join(out_data_dir, "Test", file_name) + '_' + str(num_core_events) + '_' + str(num_core_entities) + '_' + str(num_noisy_event_points)
-                        + '_' + str(num_noisy_entity_points) + ".p", "wb"))
+                split_dir = "Test"
+
+            with open(os.path.join(out_data_dir, split_dir, file_name) + '_' + str(num_core_events) + '_' + str(num_core_entities) + '_' + str(num_noisy_event_points) + '_' + str(num_noisy_entity_points) + ".p", "wb") as f:
+                f.write(buf)
 
             counter += 1
 
@@ -956,39 +1182,38 @@ if __name__ == "__main__":
                         help='Percentage of <data_size> mixtures to assign to the test set')
 
     args = parser.parse_args()
-    locals().update(vars(args))
 
     print("Params:\n", args, "\n")
 
     print("Generating mixtures ...\n")
 
-    event_types = dill.load(open(event_type_maps, 'rb'))
-    entity_types = dill.load(open(entity_type_maps, 'rb'))
+    event_types = load_map(args.event_type_maps)
+    entity_types = load_map(args.entity_type_maps)
 
-    if not match_event_names:
+    if not args.match_event_names:
         event_names = defaultdict(set)
 
         for key, value in event_types.items():
             for item in value:
                 event_names[item].add(key)
     else:
-        event_names = dill.load(open(event_name_maps, 'rb'))
+        event_names = load_map(args.event_name_maps)
 
-    if not match_entity_names:
+    if not args.match_entity_names:
         entity_names = defaultdict(set)
 
         for key, value in entity_types.items():
             for item in value:
                 entity_names[item].add(key)
     else:
-        entity_names = dill.load(open(entity_name_maps, 'rb'))
+        entity_names = load_map(args.entity_name_maps)
 
-    one_step_connectedness_map = dill.load(open(one_step_connectedness_map, 'rb'))
-    two_step_connectedness_map = dill.load(open(two_step_connectedness_map, 'rb'))
+    one_step_connectedness_map = load_map(args.one_step_connectedness_map)
+    two_step_connectedness_map = load_map(args.two_step_connectedness_map)
 
-    make_mixture_data(single_doc_graphs_folder, event_names, entity_names, event_types, entity_types, one_step_connectedness_map, two_step_connectedness_map,
-                      out_data_dir, num_sources, num_shared_eres, num_total_merge_points, num_noisy_sources, num_noisy_events, num_noisy_entities,
-                      num_abridge_hops, data_size, max_size, print_every, min_connectedness_one_step, min_connectedness_two_step, max_connectedness_two_step, noisy_min_connectedness_one_step, noisy_min_connectedness_two_step,
-                      perc_train, perc_test)
+    make_mixture_data(args.single_doc_graphs_folder, event_names, entity_names, event_types, entity_types, one_step_connectedness_map, two_step_connectedness_map,
+                      args.out_data_dir, args.num_sources, args.num_shared_eres, args.num_total_merge_points, args.num_noisy_sources, args.num_noisy_events, args.num_noisy_entities,
+                      args.num_abridge_hops, args.data_size, args.max_size, args.print_every, args.min_connectedness_one_step, args.min_connectedness_two_step, args.max_connectedness_two_step,
+                      args.noisy_min_connectedness_one_step, args.noisy_min_connectedness_two_step, args.perc_train, args.perc_test)
 
-    print("Done!\n")
\ No newline at end of file
+    print("Done!\n")
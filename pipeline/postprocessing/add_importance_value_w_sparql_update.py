@@ -1,6 +1,15 @@
-import math
+import logging
+import os
 from argparse import ArgumentParser
-from operator import itemgetter
+from functools import lru_cache
+from multiprocessing import Pool
+
+import numpy as np
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 from aida_utexas import util
 from aida_utexas.aif import JsonGraph, AIDA, LDC, LDC_ONT, UTEXAS
@@ -13,43 +22,270 @@ update_prefix = \
     f'PREFIX ldc: {LDC}\n' \
     f'PREFIX utexas: {UTEXAS}\n\n'
 
+subgraph_update_tmpl = \
+    'INSERT {{\n' \
+    '{} aida:subgraphContains ?e .\n' \
+    '}}\nWHERE\n{{\n' \
+    '{{ ?e a aida:Entity }}\nUNION\n' \
+    '{{ ?e a aida:Relation }}\nUNION\n' \
+    '{{ ?e a aida:Event }}\n}}\n'
+
+# Maximum number of buffers accepted by a single writev call
+IOV_MAX = os.sysconf('SC_IOV_MAX') if 'SC_IOV_MAX' in os.sysconf_names else 1024
+
+
+# The node importance triple and the statement importance update are formatted for every node and
+# statement of every hypothesis, so they are written as f-strings rather than str.format templates.
+def format_node_importance(node_id, importance_value):
+    return f'  <{node_id}> aida:importance "{importance_value:.4f}"^^xsd:double .\n'
+
+
+def format_stmt_update(importance_value, stmt_subj, stmt_pred, stmt_obj):
+    return f'INSERT {{ ?x aida:importance "{importance_value:.4f}"^^xsd:double . }}\n' + \
+        format_stmt_pattern(stmt_subj, stmt_pred, stmt_obj)
+
+
+# The same statements recur across many hypotheses, so the WHERE clause matching each statement
+# is built once per (subject, predicate, object) triple and reused. The cache is bounded, so each
+# worker keeps only the most recently used clauses rather than one per statement in the KB.
+@lru_cache(maxsize=65536)
+def format_stmt_pattern(stmt_subj, stmt_pred, stmt_obj):
+    return f'WHERE\n{{\n' \
+        f'?x a rdf:Statement .\n' \
+        f'?x rdf:subject <{stmt_subj}> .\n' \
+        f'?x rdf:predicate ldcOnt:{stmt_pred} .\n' \
+        f'?x rdf:object <{stmt_obj}> .\n}}\n'
+
+
+# Write a query file from a list of string chunks with a bare open/writev/close, skipping the
+# buffered text I/O layer (and its extra fstat/ioctl/lseek calls), and without first joining
+# the chunks into one large string.
+def write_query(output_path, update_chunks):
+    bufs = [memoryview(chunk.encode('utf-8')) for chunk in update_chunks if chunk]
+    idx = 0
+    fd = os.open(str(output_path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while idx < len(bufs):
+            written = os.writev(fd, bufs[idx:idx + IOV_MAX])
+            # skip past the fully written buffers, and trim a partially written one
+            while idx < len(bufs) and written >= len(bufs[idx]):
+                written -= len(bufs[idx])
+                idx += 1
+            if written:
+                bufs[idx] = bufs[idx][written:]
+    finally:
+        os.close(fd)
+
+
+# Map raw (log-scale) weights to importance values: exp(weight / scale) for non-positive weights,
+# and 0.0001 otherwise. Computed over the whole array at once, returned as a list of floats.
+def compute_weights(raw_weights, scale):
+    raw_weights = np.asarray(raw_weights, dtype=np.float64)
+    # clamp before exp, as np.where evaluates both branches
+    return np.where(raw_weights <= 0.0, np.exp(np.minimum(raw_weights, 0.0) / scale),
+                    0.0001).tolist()
+
+
+# Indices of the <top> highest probs in descending order (ties broken by lower index first, as a
+# stable sort would), found with a partial partition rather than sorting all the probs.
+def rank_top_hypotheses(probs, top):
+    neg_probs = -probs
+    if top < len(neg_probs):
+        kth = np.partition(neg_probs, top - 1)[top - 1]
+        # keep every candidate tied with the top-th prob, so that the stable sort below picks
+        # the same (lowest-index) ones a full sort would
+        candidates = np.flatnonzero(neg_probs <= kth)
+    else:
+        candidates = np.arange(len(neg_probs))
+    return candidates[np.argsort(neg_probs[candidates], kind='stable')][:top].tolist()
+
+
+# Resolve what a statement contributes to the importance mappings: the (subject, predicate, object)
+# key of its stmt_importance entry (None for typing statements), and the cluster prototypes whose
+# node_importance it updates (empty unless its subject is an event or relation).
+def resolve_stmt(stmt_label, stmt_spo_index, event_relation_ids, member_to_clusters,
+                 cluster_to_prototype, subject_prototypes):
+    stmt_spo = stmt_spo_index.get(stmt_label)
+    assert stmt_spo is not None
+
+    stmt_subj, stmt_pred, stmt_obj = stmt_spo
+
+    assert stmt_subj is not None
+    assert stmt_pred is not None
+    assert stmt_obj is not None
+
+    stmt_key = stmt_spo if stmt_pred != 'type' else None
+
+    if stmt_subj not in event_relation_ids:
+        return stmt_key, ()
+
+    prototypes = subject_prototypes.get(stmt_subj)
+    if prototypes is None:
+        prototypes = tuple(cluster_to_prototype[cluster]
+                           for cluster in member_to_clusters[stmt_subj]
+                           if cluster_to_prototype.get(cluster, None) is not None)
+        subject_prototypes[stmt_subj] = prototypes
+
+    return stmt_key, prototypes
+
+
+def compute_importance_mapping(json_graph, hypothesis, member_to_clusters, cluster_to_prototype,
+                               stmt_spo_index=None, subject_prototypes=None,
+                               stmt_importance=None, node_importance=None,
+                               event_relation_ids=None, resolved_stmts=None):
+    if stmt_spo_index is None:
+        stmt_spo_index = json_graph.build_stmt_spo_index()
+    if event_relation_ids is None:
+        event_relation_ids = json_graph.build_event_relation_index()
+    # caches of the cluster prototypes of each statement subject, and of the output of
+    # resolve_stmt() for each statement; both can be shared across hypotheses
+    if subject_prototypes is None:
+        subject_prototypes = {}
+    if resolved_stmts is None:
+        resolved_stmts = {}
+
+    # the output dicts can be passed in to be reused across hypotheses (they are cleared first)
+    if stmt_importance is None:
+        stmt_importance = {}
+    else:
+        stmt_importance.clear()
+    if node_importance is None:
+        node_importance = {}
+    else:
+        node_importance.clear()
+
+    stmt_weights = compute_weights(hypothesis['statementWeights'], scale=100.0)
+
+    for stmt_label, stmt_weight in zip(hypothesis['statements'], stmt_weights):
+        resolved = resolved_stmts.get(stmt_label)
+        if resolved is None:
+            resolved = resolve_stmt(stmt_label, stmt_spo_index, event_relation_ids,
+                                    member_to_clusters, cluster_to_prototype, subject_prototypes)
+            resolved_stmts[stmt_label] = resolved
+
+        stmt_key, prototypes = resolved
+
+        if stmt_key is not None:
+            stmt_importance[stmt_key] = stmt_weight
+
+        for prototype in prototypes:
+            current_weight = node_importance.get(prototype)
+            if current_weight is None or current_weight < stmt_weight:
+                node_importance[prototype] = stmt_weight
 
-def compute_importance_mapping(json_graph, hypothesis, member_to_clusters, cluster_to_prototype):
-    stmt_importance = {}
-    node_importance = {}
-
-    for stmt_label, stmt_weight in zip(hypothesis['statements'], hypothesis['statementWeights']):
-        if stmt_weight <= 0.0:
-            stmt_weight = math.exp(stmt_weight / 100.0)
-        else:
-            stmt_weight = 0.0001
-
-        stmt_subj = json_graph.stmt_subject(stmt_label)
-        stmt_pred = json_graph.stmt_predicate(stmt_label)
-        stmt_obj = json_graph.stmt_object(stmt_label)
-
-        assert stmt_subj is not None
-        assert stmt_pred is not None
-        assert stmt_obj is not None
-
-        if stmt_pred != 'type':
-            stmt_importance[(stmt_subj, stmt_pred, stmt_obj)] = stmt_weight
-
-        if json_graph.is_event(stmt_subj) or json_graph.is_relation(stmt_subj):
-            # if stmt_subj not in node_importance:
-            #     node_importance[stmt_subj] = stmt_weight
-            # elif node_importance[stmt_subj] < stmt_weight:
-            #     node_importance[stmt_subj] = stmt_weight
+    return stmt_importance, node_importance
 
-            for cluster in member_to_clusters[stmt_subj]:
-                prototype = cluster_to_prototype.get(cluster, None)
-                if prototype is not None:
-                    if prototype not in node_importance:
-                        node_importance[prototype] = stmt_weight
-                    elif node_importance[prototype] < stmt_weight:
-                        node_importance[prototype] = stmt_weight
 
-    return stmt_importance, node_importance
+# State shared by all hypotheses processed in a (worker) process, set up by init_worker()
+_worker_state = {}
+
+
+def init_worker(json_graph, mappings, stmt_spo_index, event_relation_ids, output_dir, frame_id):
+    _worker_state['json_graph'] = json_graph
+    _worker_state['mappings'] = mappings
+    _worker_state['stmt_spo_index'] = stmt_spo_index
+    _worker_state['event_relation_ids'] = event_relation_ids
+    _worker_state['output_dir'] = output_dir
+    _worker_state['frame_id'] = frame_id
+    _worker_state['subject_prototypes'] = {}
+    _worker_state['resolved_stmts'] = {}
+    _worker_state['stmt_importance'] = {}
+    _worker_state['node_importance'] = {}
+
+
+# Build and write the update request for the <top_count>-th ranked hypothesis
+def process_hypothesis(top_count, hypothesis, hyp_weight):
+    json_graph = _worker_state['json_graph']
+    mappings = _worker_state['mappings']
+
+    hypothesis_id = '{}_hypothesis_{:0>3d}'.format(_worker_state['frame_id'], top_count)
+
+    hypothesis_name = 'utexas:{}'.format(hypothesis_id)
+    subgraph_name = hypothesis_name + '_subgraph'
+
+    # All update operations for the hypothesis are collected here, and written as a single
+    # SPARQL update request (operations separated by ";") to one file per hypothesis.
+    update_ops = []
+
+    # Build an update operation to add aida:Hypothesis and its importance values, as well as
+    # the importance values for all event and relation clusters.
+    parts = ['INSERT DATA\n{\n']
+    parts.append('  {} a aida:Hypothesis .\n'.format(hypothesis_name))
+    parts.append('  {} aida:importance "{:.4f}"^^xsd:double .\n'.format(
+        hypothesis_name, hyp_weight))
+    parts.append('  {} aida:hypothesisContent {} .\n'.format(hypothesis_name, subgraph_name))
+    parts.append('  {} a aida:Subgraph .\n'.format(subgraph_name))
+
+    stmt_importance, node_importance = compute_importance_mapping(
+        json_graph, hypothesis, member_to_clusters=mappings['member_to_clusters'],
+        cluster_to_prototype=mappings['cluster_to_prototype'],
+        stmt_spo_index=_worker_state['stmt_spo_index'],
+        subject_prototypes=_worker_state['subject_prototypes'],
+        stmt_importance=_worker_state['stmt_importance'],
+        node_importance=_worker_state['node_importance'],
+        event_relation_ids=_worker_state['event_relation_ids'],
+        resolved_stmts=_worker_state['resolved_stmts'])
+
+    for node_id, importance_value in node_importance.items():
+        parts.append(format_node_importance(node_id, importance_value))
+
+    parts.append('}\n')
+
+    update_ops.append(''.join(parts))
+
+    # Build an update operation for the aida:subgraphContains field of the aida:Subgraph node
+    # as the aida:hypothesisContent. We just include all ERE nodes for simplicity, as it's not
+    # required that all KEs should be included for NIST to evaluate in M18.
+    update_ops.append(subgraph_update_tmpl.format(subgraph_name))
+
+    # Build an update operation for the importance value of each statement. We would need
+    # a separate operation for each statement, because we need to use the INSERT {} WHERE {}
+    # operator here to allow BNode statements.
+    for (stmt_subj, stmt_pred, stmt_obj), importance_value in stmt_importance.items():
+        update_ops.append(
+            format_stmt_update(importance_value, stmt_subj, stmt_pred, stmt_obj))
+
+    output_path = _worker_state['output_dir'] / 'hypothesis-{:0>3d}-update.rq'.format(top_count)
+
+    update_chunks = [update_prefix]
+    for update_op in update_ops:
+        update_chunks.append(update_op)
+        update_chunks.append(';\n')
+    update_chunks.pop()
+
+    write_query(output_path, update_chunks)
+
+
+# Read the hypotheses file, returning the probs of all hypotheses, the indices of the <top> ranked
+# ones, and a mapping from each of those indices to its hypothesis. When ijson is available, the
+# file is streamed twice (once for the probs, once for the selected hypotheses), so the
+# hypotheses which are not selected are never held in memory.
+def read_top_hypotheses(hypotheses_path, top):
+    if ijson is None:
+        hypotheses_json = util.read_json_file(hypotheses_path, 'hypotheses')
+        probs = np.asarray(hypotheses_json['probs'], dtype=np.float64)
+        ranked_indices = rank_top_hypotheses(probs, top)
+        support = hypotheses_json['support']
+        return probs, ranked_indices, {idx: support[idx] for idx in ranked_indices}
+
+    hypotheses_path = util.get_input_path(hypotheses_path)
+    logging.info(f'Streaming hypotheses from {hypotheses_path} ...')
+
+    with open(str(hypotheses_path), 'rb') as fin:
+        probs = np.fromiter(ijson.items(fin, 'probs.item', use_float=True), dtype=np.float64)
+    ranked_indices = rank_top_hypotheses(probs, top)
+
+    wanted = set(ranked_indices)
+    hypotheses = {}
+    if wanted:
+        with open(str(hypotheses_path), 'rb') as fin:
+            for idx, hypothesis in enumerate(ijson.items(fin, 'support.item', use_float=True)):
+                if idx in wanted:
+                    hypotheses[idx] = hypothesis
+                    if len(hypotheses) == len(wanted):
+                        break
+
+    return probs, ranked_indices, hypotheses
 
 
 def main():
@@ -60,6 +296,8 @@ def main():
     parser.add_argument('frame_id', help='Frame ID of the hypotheses')
     parser.add_argument('--top', default=50, type=int,
                         help='number of top hypothesis to output')
+    parser.add_argument('--num_workers', default=None, type=int,
+                        help='number of worker processes (default: number of CPUs)')
     parser.add_argument('-f', '--force', action='store_true', default=False,
                         help='If specified, overwrite existing output files without warning')
 
@@ -67,102 +305,32 @@ def main():
 
     json_graph = JsonGraph.from_dict(util.read_json_file(args.graph_path, 'JSON graph'))
     mappings = json_graph.build_cluster_member_mappings()
+    stmt_spo_index = json_graph.build_stmt_spo_index()
+    event_relation_ids = json_graph.build_event_relation_index()
 
-    hypotheses_json = util.read_json_file(args.hypotheses_path, 'hypotheses')
+    probs, ranked_indices, hypotheses = read_top_hypotheses(args.hypotheses_path, args.top)
 
     output_dir = util.get_output_dir(args.output_dir, overwrite_warning=not args.force)
-    frame_id = args.frame_id
-
-    top_count = 0
-
-    for result_idx, prob in sorted(
-            enumerate(hypotheses_json['probs']), key=itemgetter(1), reverse=True):
-        if prob <= 0.0:
-            hyp_weight = math.exp(prob / 2.0)
-        else:
-            hyp_weight = 0.0001
-
-        hypothesis = hypotheses_json['support'][result_idx]
-
-        top_count += 1
-
-        hypothesis_id = '{}_hypothesis_{:0>3d}'.format(frame_id, top_count)
-
-        hypothesis_name = 'utexas:{}'.format(hypothesis_id)
-        subgraph_name = hypothesis_name + '_subgraph'
-
-        update_query_count = 0
-
-        # Build an update query to add aida:Hypothesis and its importance values, as well as
-        # the importance values for all event and relation clusters.
-        update_str = update_prefix + 'INSERT DATA\n{\n'
-        update_str += '  {} a aida:Hypothesis .\n'.format(hypothesis_name)
-        update_str += '  {} aida:importance "{:.4f}"^^xsd:double .\n'.format(
-            hypothesis_name, hyp_weight)
-        update_str += '  {} aida:hypothesisContent {} .\n'.format(hypothesis_name, subgraph_name)
-        update_str += '  {} a aida:Subgraph .\n'.format(subgraph_name)
-
-        stmt_importance, node_importance = compute_importance_mapping(
-            json_graph, hypothesis, member_to_clusters=mappings['member_to_clusters'],
-            cluster_to_prototype=mappings['cluster_to_prototype'])
-
-        for node_id, importance_value in node_importance.items():
-            update_str += '  <{}> aida:importance "{:.4f}"^^xsd:double .\n'.format(
-                node_id, importance_value)
-
-        update_str += '}'
-
-        output_path = output_dir / 'hypothesis-{:0>3d}-update-{:0>4d}.rq'.format(
-            top_count, update_query_count)
-
-        with open(str(output_path), 'w') as fout:
-            fout.write(update_str)
-
-        update_query_count += 1
-
-        # Build an update query for the aida:subgraphContains field of the aida:Subgraph node as
-        # the aida:hypothesisContent. We just include all ERE nodes for simplicity, as it's not
-        # required that all KEs should be included for NIST to evaluate in M18.
-        update_str = update_prefix
-        update_str += \
-            'INSERT {{\n' \
-            '{} aida:subgraphContains ?e .\n' \
-            '}}\nWHERE\n{{\n' \
-            '{{ ?e a aida:Entity }}\nUNION\n' \
-            '{{ ?e a aida:Relation }}\nUNION\n' \
-            '{{ ?e a aida:Event }}\n}}\n'.format(subgraph_name)
-
-        output_path = output_dir / 'hypothesis-{:0>3d}-update-{:0>4d}.rq'.format(
-            top_count, update_query_count)
-        with open(str(output_path), 'w') as fout:
-            fout.write(update_str)
-
-        update_query_count += 1
-
-        # Build an update query for the importance value of each statement. We would need
-        # a separate query for each statement, because we need to use the INSERT {} WHERE {}
-        # operator here to allow BNode statements.
-        for (stmt_subj, stmt_pred, stmt_obj), importance_value in stmt_importance.items():
-            update_str = update_prefix
-            update_str += \
-                'INSERT {{ ?x aida:importance "{:.4f}"^^xsd:double . }}\n' \
-                'WHERE\n{{\n' \
-                '?x a rdf:Statement .\n' \
-                '?x rdf:subject <{}> .\n' \
-                '?x rdf:predicate ldcOnt:{} .\n' \
-                '?x rdf:object <{}> .\n}}\n'.format(
-                    importance_value, stmt_subj, stmt_pred, stmt_obj)
-
-            output_path = output_dir / 'hypothesis-{:0>3d}-update-{:0>4d}.rq'.format(
-                top_count, update_query_count)
-
-            with open(str(output_path), 'w') as fout:
-                fout.write(update_str)
-
-            update_query_count += 1
-
-        if top_count >= args.top:
-            break
+
+    hyp_weights = compute_weights(probs, scale=2.0)
+
+    tasks = [(top_count, hypotheses[result_idx], hyp_weights[result_idx])
+             for top_count, result_idx in enumerate(ranked_indices, start=1)]
+
+    init_args = (json_graph, mappings, stmt_spo_index, event_relation_ids, output_dir,
+                 args.frame_id)
+
+    num_workers = min(args.num_workers or os.cpu_count() or 1, len(tasks))
+
+    # Hypotheses are independent of each other, so they are processed in parallel; the graph and
+    # mappings are handed to each worker once through the pool initializer.
+    if num_workers > 1:
+        with Pool(num_workers, initializer=init_worker, initargs=init_args) as pool:
+            pool.starmap(process_hypothesis, tasks)
+    else:
+        init_worker(*init_args)
+        for task in tasks:
+            process_hypothesis(*task)
 
 
 if __name__ == '__main__':
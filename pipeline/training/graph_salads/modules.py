@@ -11,6 +11,29 @@ import torch.nn as nn
 import torch.nn.functional as F
 from pipeline.training.graph_salads.utils import *
 
+# Normalize attention scores over the attendees (dim 0) and apply dropout to the resulting weights (in training only)
+def softmax_dropout(scores, p, training):
+    attention_weights = F.softmax(scores, dim=0)
+
+    return F.dropout(attention_weights, p=p) if training else attention_weights
+
+# On the GPU, softmax_dropout is compiled so that the softmax and dropout run as one fused kernel
+# (the attention weights are written once rather than twice); the number of attendees/attenders varies between calls
+fused_softmax_dropout = torch.compile(softmax_dropout, dynamic=True) if hasattr(torch, 'compile') else softmax_dropout
+
+# Apply a Linear layer to the concatenation (along the last dim) of a list of (N x d_i) inputs without materializing it,
+# by accumulating the product of each input with the matching column block of the weight
+def concat_linear(inputs, linear):
+    outputs = None
+    start = 0
+
+    for item in inputs:
+        weight = linear.weight[:, start:start + item.size(-1)]
+        outputs = F.linear(item, weight, linear.bias) if outputs is None else torch.addmm(outputs, item, weight.t())
+        start += item.size(-1)
+
+    return outputs
+
 # Scoring function for attention mechanism; either "bilinear" or "concatentative" (both from Luong et al., 2015)
 class Score(nn.Module):
     def __init__(self, attention_type, hidden_size):
@@ -34,10 +57,12 @@ class Score(nn.Module):
         if self.attention_type == 'bilinear':
             return self.bilinear(first_inputs).mm(second_inputs.transpose(0, 1))
         elif self.attention_type == 'concat':
-            num_attendees = first_inputs.size(0)
-            num_attenders = second_inputs.size(0)
-            concat_inputs = torch.cat([first_inputs.unsqueeze(1).expand(-1, num_attenders, -1), second_inputs.unsqueeze(0).expand(num_attendees, -1, -1)], dim=-1)
-            return self.single(torch.tanh(self.concat(concat_inputs))).squeeze(-1)
+            # concat is affine, so project the attendees and attenders separately with the two halves of its weight
+            # and broadcast-add, rather than building every (attendee, attender) concatenation
+            hidden_size = first_inputs.size(-1)
+            first_proj = F.linear(first_inputs, self.concat.weight[:, :hidden_size], self.concat.bias)
+            second_proj = F.linear(second_inputs, self.concat.weight[:, hidden_size:])
+            return self.single(torch.tanh(first_proj.unsqueeze(1) + second_proj.unsqueeze(0))).squeeze(-1)
 
 # Attention mechanism after Luong et. al, 2015
 # Source: https://github.com/tensorflow/nmt#background-on-the-attention-mechanism
@@ -68,30 +93,31 @@ class Attention(nn.Module):
 
         self.att_dropout = torch.nn.Dropout(p=attention_dropout, inplace=False)
 
+    # Score the attendees against each attender and normalize the scores over the attendees (dim 0);
+    # with a single attendee the normalized weights are all 1, so the scoring and softmax are skipped
+    def normalized_attention_weights(self, score, attendees, attender):
+        if attendees.size(0) == 1:
+            attention_weights = attender.new_ones((1, attender.size(0)))
+
+            return self.att_dropout(attention_weights) if self.training else attention_weights
+
+        scores = score(attendees, attender)
+
+        if scores.is_cuda:
+            return fused_softmax_dropout(scores, self.att_dropout.p, self.training)
+        else:
+            return softmax_dropout(scores, self.att_dropout.p, self.training)
+
     # Compute attention weights (Eq 1 in source)
     # We compute (candidate stmt)-to-(query stmt) and (candidate stmt)-to-(query ERE) weights separately
     def get_attention_weights(self, attendee_stmts, attendee_eres, attender):
         if attendee_stmts is None:
-            unnorm_self_attention_weights_eres = self.score_ere_to_ere_plaus(attendee_eres, attender)
-            self_attention_weights_eres = F.softmax(unnorm_self_attention_weights_eres, dim=0)
-            self_attention_weights_eres = self.att_dropout(self_attention_weights_eres)
-
-            return self_attention_weights_eres
+            return self.normalized_attention_weights(self.score_ere_to_ere_plaus, attendee_eres, attender)
         elif attendee_eres is None:
-            unnorm_self_attention_weights_stmts = self.score_stmt_to_stmt_plaus(attendee_stmts, attender)
-            self_attention_weights_stmts = F.softmax(unnorm_self_attention_weights_stmts, dim=0)
-            self_attention_weights_stmts = self.att_dropout(self_attention_weights_stmts)
-
-            return self_attention_weights_stmts
+            return self.normalized_attention_weights(self.score_stmt_to_stmt_plaus, attendee_stmts, attender)
         else:
-            unnorm_attention_weights_stmt_to_stmt = self.score_stmt_to_stmt(attendee_stmts, attender)
-            unnorm_attention_weights_ere_to_stmt = self.score_ere_to_stmt(attendee_eres, attender)
-
-            attention_weights_stmt_to_stmt = F.softmax(unnorm_attention_weights_stmt_to_stmt, dim=0)
-            attention_weights_ere_to_stmt = F.softmax(unnorm_attention_weights_ere_to_stmt, dim=0)
-
-            attention_weights_stmt_to_stmt = self.att_dropout(attention_weights_stmt_to_stmt)
-            attention_weights_ere_to_stmt = self.att_dropout(attention_weights_ere_to_stmt)
+            attention_weights_stmt_to_stmt = self.normalized_attention_weights(self.score_stmt_to_stmt, attendee_stmts, attender)
+            attention_weights_ere_to_stmt = self.normalized_attention_weights(self.score_ere_to_stmt, attendee_eres, attender)
 
             attention_weights = (attention_weights_stmt_to_stmt, attention_weights_ere_to_stmt)
 
@@ -112,36 +138,175 @@ class Attention(nn.Module):
 
             return (context_vectors_stmt_to_stmt, context_vectors_ere_to_stmt)
 
+    # Calculate (plausibility) self-attention vectors from already computed attention weights
+    def get_plaus_attention_vectors(self, attendees, attention_weights, attender):
+        context_vectors = self.get_context_vectors(attendees, attention_weights)
+
+        if self.use_attender_vectors:
+            return torch.tanh(concat_linear([attender, context_vectors], self.linear_plaus))
+        else:
+            return torch.tanh(self.linear_plaus(context_vectors))
+
     # Calculate attention vectors for candidate statements
     def get_attention_vectors(self, attendee_stmts, attendee_eres, attender):
         attention_weights = self.get_attention_weights(attendee_stmts, attendee_eres, attender)
 
         if self.plaus:
             if attendee_stmts is None:
-                context_vectors = self.get_context_vectors(attendee_eres, attention_weights)
+                attention_vectors = self.get_plaus_attention_vectors(attendee_eres, attention_weights, attender)
             elif attendee_eres is None:
-                context_vectors = self.get_context_vectors(attendee_stmts, attention_weights)
-
-            if self.use_attender_vectors:
-                attention_vectors = torch.tanh(self.linear_plaus(torch.cat([attender, context_vectors], dim=-1)))
-            else:
-                attention_vectors = torch.tanh(self.linear_plaus(context_vectors))
+                attention_vectors = self.get_plaus_attention_vectors(attendee_stmts, attention_weights, attender)
         else:
             context_vectors = self.get_context_vectors((attendee_stmts, attendee_eres), attention_weights)
 
             # Concat candidate statements with their context vectors and feed into a tanh layer to produce attention vectors
-            attention_vectors = torch.tanh(self.linear(torch.cat([attender, context_vectors[0], context_vectors[1]], dim=-1)))
+            attention_vectors = torch.tanh(concat_linear([attender, context_vectors[0], context_vectors[1]], self.linear))
 
         return attention_vectors
 
-# Simple conversion to tensor
-def to_tensor(inputs, tensor_type=torch.LongTensor, device=torch.device("cpu")):
-    return tensor_type(np.array(inputs)).to(device)
+# Simple conversion to tensor (lists and numpy arrays are converted straight onto the device; tensors are passed through)
+def to_tensor(inputs, dtype=torch.long, device=torch.device("cpu")):
+    return torch.as_tensor(inputs, dtype=dtype, device=device)
+
+# Move a CSR tensor to the given device; CUDA copies go through pinned memory so they can be made asynchronously
+def csr_to_device(csr, device):
+    if device.type != 'cuda':
+        return csr.to(device)
+
+    crow_indices, col_indices, values = [item.pin_memory().to(device, non_blocking=True) for item in (csr.crow_indices(), csr.col_indices(), csr.values())]
+
+    return torch.sparse_csr_tensor(crow_indices, col_indices, values, csr.shape)
+
+# Build a CSR tensor whose column num_slots * n + r holds column n of (the transpose of, if asked) the dense matrix adjs[r];
+# it is assembled from the nonzero coordinates, so neither the transposes nor the interleaved matrix are ever made dense
+def interleave_adjs(adjs, num_slots, transpose):
+    indices = []
+    values = []
+
+    for slot, adj in enumerate(adjs):
+        rows, cols = np.nonzero(adj)
+        values.append(adj[rows, cols])
+        if transpose:
+            rows, cols = cols, rows
+        indices.append(np.stack([rows, cols * num_slots + slot]))
+
+    num_rows, num_cols = adjs[0].shape[::-1] if transpose else adjs[0].shape
+
+    return torch.sparse_coo_tensor(torch.from_numpy(np.concatenate(indices, axis=1)), torch.from_numpy(np.concatenate(values)),
+                                   (num_rows, num_cols * num_slots), dtype=torch.float).coalesce().to_sparse_csr()
+
+# Get the adjacency matrices of a graph as two CSR tensors on the given device:
+# (i)  a (num_eres x 4 * num_stmts) matrix whose column 4 * s + r holds column s of adj_head/adj_tail/adj_type (for r = 0/1/2);
+#      column 4 * s + 3 is empty, and lines up with the stmt self projection computed alongside the head/tail/type projections
+# (ii) a (num_stmts x 2 * num_eres) matrix whose column 2 * e + r holds column e of the transposed adj_head/adj_tail (for r = 0/1)
+# Interleaving the relations this way means a single SpMM against the row-major output of a fused head/tail(/type)
+# projection sums the aggregations over all relations. The dense matrices are converted on the host, so only the
+# nonzeros are copied to the device, and the result is cached in graph_dict so later GCN passes over the same graph reuse it
+def get_sparse_adjs(graph_dict, device):
+    if graph_dict.get('sparse_adj_device') != device:
+        adj_head, adj_tail, adj_type = graph_dict['adj_head'], graph_dict['adj_tail'], graph_dict['adj_type']
+
+        adj_ere = interleave_adjs([adj_head, adj_tail, adj_type], 4, False)
+        adj_stmt = interleave_adjs([adj_head, adj_tail], 2, True)
+
+        graph_dict['sparse_adjs'] = (csr_to_device(adj_ere, device), csr_to_device(adj_stmt, device))
+        graph_dict['sparse_adj_device'] = device
+
+    return graph_dict['sparse_adjs']
+
+# Copy an array of indices to the device as a LongTensor; CUDA copies go through pinned memory so they can be made asynchronously
+def indices_to_device(indices, device):
+    indices = torch.from_numpy(indices.astype(np.int64, copy=False))
+
+    if device.type == 'cuda':
+        return indices.pin_memory().to(device, non_blocking=True)
+    else:
+        return indices.to(device)
+
+# Flatten per-node lists of label sets into a single list of label indices, along with the length of each
+# (non-empty) label set and the number of non-empty label sets of each node (padded with zeros up to num_nodes)
+def flatten_label_sets(labels, num_nodes):
+    label_ids = []
+    set_lengths = []
+    node_lengths = []
+
+    for label_sets in labels:
+        num_label_sets = 0
+
+        for label_set in label_sets:
+            if len(label_set) > 0:
+                label_ids.extend(label_set)
+                set_lengths.append(len(label_set))
+                num_label_sets += 1
+
+        node_lengths.append(num_label_sets)
+
+    node_lengths += [0] * (num_nodes - len(node_lengths))
+
+    return label_ids, set_lengths, node_lengths
+
+# Embed every label of every node with a single embedder call, then average within each label set
+# and across the label sets of each node; the embedding table may be stored in bfloat16 (see gen_hypoth),
+# in which case the looked-up rows are upcast so the averaging and the rest of the GCN run in float32
+def embed_label_sets(embedder, labels, num_nodes, device):
+    label_ids, set_lengths, node_lengths = flatten_label_sets(labels, num_nodes)
+
+    # The labels of a label set (and the label sets of a node) are contiguous, so each average is a segment
+    # reduction writing straight into its output
+    label_embs = embedder(to_tensor(label_ids, device=device)).float()
+    set_embs = torch.segment_reduce(label_embs, 'mean', lengths=to_tensor(set_lengths, device=device), initial=0)
+
+    return torch.segment_reduce(set_embs, 'mean', lengths=to_tensor(node_lengths, device=device), initial=0)
+
+# Apply several Linear layers which share the same input as a single matmul over their stacked weights;
+# row i of the output holds the outputs of each layer (in order) for row i of the inputs
+def fused_linear(inputs, linears):
+    weight = torch.cat([linear.weight for linear in linears], dim=0)
+    bias = torch.cat([linear.bias for linear in linears], dim=0)
+
+    return F.linear(inputs, weight, bias)
+
+# ReLU on the output of a GCN layer, followed by dropout (in training only); at inference the ReLU is applied in place
+# (the layer output is a fresh addmm result which nothing else reads)
+def relu_dropout(inputs, p, training):
+    return F.dropout(F.relu(inputs), p=p) if training else F.relu_(inputs)
+
+# On the GPU, relu_dropout is compiled so the ReLU and dropout of each GCN layer run as one fused kernel
+compiled_relu_dropout = torch.compile(relu_dropout, dynamic=True) if hasattr(torch, 'compile') else relu_dropout
+
+# Get attention vectors for candidate statements, then a final set of logits for them (softmax later)
+def score_candidates(model, stmt_attendees, ere_attendees, attenders):
+    coherence_attention_vectors = model.coherence_attention.get_attention_vectors(stmt_attendees, ere_attendees, attenders)
+
+    return coherence_attention_vectors, model.coherence_linear(coherence_attention_vectors).squeeze(-1)
+
+# Unlike the GCN (which works off the graph_dict and sparse adjacencies), candidate scoring is a short chain of small
+# dense ops run once per extraction, so on the GPU it is compiled to cut per-op dispatch; the numbers of query stmts/EREs
+# and candidates change every extraction, so shapes are kept dynamic (which also rules out CUDA graphs)
+compiled_score_candidates = torch.compile(score_candidates, dynamic=True) if hasattr(torch, 'compile') else score_candidates
+
+# Given the (already normalized and dropped-out) stmt and ERE self-attention weights, compute the self-attention vectors,
+# average them, and map their concatenation to a plausibility logit
+def score_plausibility(model, stmt_attendees, stmt_attention_weights, ere_attendees, ere_attention_weights):
+    self_att_vectors_stmts = model.coherence_attention.get_plaus_attention_vectors(stmt_attendees, stmt_attention_weights, stmt_attendees)
+    self_att_vectors_eres = model.coherence_attention.get_plaus_attention_vectors(ere_attendees, ere_attention_weights, ere_attendees)
+
+    stmts_vector = torch.mean(self_att_vectors_stmts, dim=0)
+    eres_vector = torch.mean(self_att_vectors_eres, dim=0)
+
+    final_vector = torch.cat([stmts_vector, eres_vector], dim=0)
+
+    return model.linear_plaus(final_vector)
+
+# The plausibility tail is a chain of small pointwise/matmul ops, so on the GPU it is compiled as well; dropout
+# (applied to the attention weights) is kept out of it
+compiled_score_plausibility = torch.compile(score_plausibility, dynamic=True) if hasattr(torch, 'compile') else score_plausibility
 
 # Class defining the GCN architecture
 # forward() method runs graphs through GCN and attention mechanism
+# If share_layer_weights is set, layers 3 and 4 reuse the weights of layer 2 instead of having their own
 class CoherenceNetWithGCN(nn.Module):
-    def __init__(self, plaus, indexer_info_dict, attention_type, use_attender_vectors, num_layers, hidden_size, attention_size, conv_dropout, attention_dropout):
+    def __init__(self, plaus, indexer_info_dict, attention_type, use_attender_vectors, num_layers, hidden_size, attention_size, conv_dropout, attention_dropout, share_layer_weights=False):
         super(CoherenceNetWithGCN, self).__init__()
         ere_emb = indexer_info_dict['ere_emb_mat']
         stmt_emb = indexer_info_dict['stmt_emb_mat']
@@ -170,6 +335,7 @@ class CoherenceNetWithGCN(nn.Module):
         self.coherence_attention = Attention(plaus, attention_type, use_attender_vectors, hidden_size, attention_size, attention_dropout)
         self.hidden_size = hidden_size
         self.num_layers = num_layers
+        self.share_layer_weights = share_layer_weights
         self.conv_dropout = torch.nn.Dropout(p=conv_dropout, inplace=False)
         self.attention_type = attention_type
 
@@ -180,8 +346,8 @@ class CoherenceNetWithGCN(nn.Module):
             self.coherence_linear = nn.Linear(attention_size, 1)
             torch.nn.init.xavier_uniform_(self.coherence_linear.weight)
 
-        # Only needed if num_layers >= 3
-        if self.num_layers >= 3:
+        # Only needed if num_layers >= 3 (and layer weights are not shared)
+        if self.num_layers >= 3 and not share_layer_weights:
             self.linear_head_adj_stmt_3 = nn.Linear(hidden_size, hidden_size)
             self.linear_tail_adj_stmt_3 = nn.Linear(hidden_size, hidden_size)
             self.linear_type_adj_stmt_3 = nn.Linear(hidden_size, hidden_size)
@@ -198,8 +364,8 @@ class CoherenceNetWithGCN(nn.Module):
             torch.nn.init.xavier_uniform_(self.linear_ere_3.weight)
             torch.nn.init.xavier_uniform_(self.linear_stmt_3.weight)
 
-        # Only needed if num_layers == 4
-        if self.num_layers == 4:
+        # Only needed if num_layers == 4 (and layer weights are not shared)
+        if self.num_layers == 4 and not share_layer_weights:
             self.linear_head_adj_stmt_4 = nn.Linear(hidden_size, hidden_size)
             self.linear_tail_adj_stmt_4 = nn.Linear(hidden_size, hidden_size)
             self.linear_type_adj_stmt_4 = nn.Linear(hidden_size, hidden_size)
@@ -233,73 +399,56 @@ class CoherenceNetWithGCN(nn.Module):
         torch.nn.init.xavier_uniform_(self.linear_ere.weight)
         torch.nn.init.xavier_uniform_(self.linear_stmt.weight)
 
+    # Get the Linears of each GCN layer, as (ERE self projection, [head/tail/type stmt projections, stmt self projection],
+    # [head/tail ERE projections]); layer 1 reads the label embeddings and uses the "_init" weights, and layers 3 and 4 are optional
+    def gcn_layers(self):
+        layer_suffixes = ['_init', '']
+        if self.num_layers >= 3:
+            layer_suffixes.append('' if self.share_layer_weights else '_3')
+        if self.num_layers == 4:
+            layer_suffixes.append('' if self.share_layer_weights else '_4')
+
+        return [(getattr(self, 'linear_ere' + suffix),
+                 [getattr(self, name + suffix) for name in ['linear_head_adj_stmt', 'linear_tail_adj_stmt', 'linear_type_adj_stmt', 'linear_stmt']],
+                 [getattr(self, name + suffix) for name in ['linear_head_adj_ere', 'linear_tail_adj_ere']])
+                for suffix in layer_suffixes]
+
     # Runs a graph salad through the GCN network
     def gcn(self, graph_dict, gcn_embeds, device):
-        adj_head = torch.from_numpy(graph_dict['adj_head']).to(dtype=torch.float, device=device)
-        adj_tail = torch.from_numpy(graph_dict['adj_tail']).to(dtype=torch.float, device=device)
-        adj_type = torch.from_numpy(graph_dict['adj_type']).to(dtype=torch.float, device=device)
+        # The adjacency matrices are very sparse, so aggregate over them with SpMM
+        adj_ere, adj_stmt = get_sparse_adjs(graph_dict, device)
         ere_labels = graph_dict['ere_labels']
         stmt_labels = graph_dict['stmt_labels']
 
-        ere_emb = torch.zeros((adj_head.shape[0], self.ere_embedder.weight.shape[1])).to(device=device)
-        stmt_emb = torch.zeros((adj_head.shape[1], self.stmt_embedder.weight.shape[1])).to(device=device)
-
         # Fetch and average embeddings for ERE/stmt names and labels
-        for iter in range(len(ere_labels)):
-            ere_emb[iter] = torch.mean(torch.cat([self.ere_embedder(to_tensor(label_set, device=device)).mean(dim=0).reshape((1, -1)) for label_set in ere_labels[iter] if len(label_set) > 0], dim=0), dim=0)
-
-        for iter in range(len(stmt_labels)):
-            stmt_emb[iter] = torch.mean(torch.cat([self.stmt_embedder(to_tensor(label_set, device=device)).mean(dim=0).reshape((1, -1)) for label_set in stmt_labels[iter] if len(label_set) > 0], dim=0), dim=0)
-
-        # Layer 1
-        gcn_embeds['eres'] = self.linear_ere_init(ere_emb)
-        gcn_embeds['eres'] += torch.mm(adj_head, self.linear_head_adj_stmt_init(stmt_emb))
-        gcn_embeds['eres'] += torch.mm(adj_tail, self.linear_tail_adj_stmt_init(stmt_emb))
-        gcn_embeds['eres'] += torch.mm(adj_type, self.linear_type_adj_stmt_init(stmt_emb))
-        gcn_embeds['eres'] = self.conv_dropout(F.relu(gcn_embeds['eres']))
-
-        gcn_embeds['stmts'] = self.linear_stmt_init(stmt_emb)
-        gcn_embeds['stmts'] += torch.mm(torch.transpose(adj_head, 0, 1), self.linear_head_adj_ere_init(gcn_embeds['eres']))
-        gcn_embeds['stmts'] += torch.mm(torch.transpose(adj_tail, 0, 1), self.linear_tail_adj_ere_init(gcn_embeds['eres']))
-        gcn_embeds['stmts'] = self.conv_dropout(F.relu(gcn_embeds['stmts']))
-
-        # Layer 2
-        gcn_embeds['eres'] = self.linear_ere(gcn_embeds['eres'])
-        gcn_embeds['eres'] += torch.mm(adj_head, self.linear_head_adj_stmt(gcn_embeds['stmts']))
-        gcn_embeds['eres'] += torch.mm(adj_tail, self.linear_tail_adj_stmt(gcn_embeds['stmts']))
-        gcn_embeds['eres'] += torch.mm(adj_type, self.linear_type_adj_stmt(gcn_embeds['stmts']))
-        gcn_embeds['eres'] = self.conv_dropout(F.relu(gcn_embeds['eres']))
-
-        gcn_embeds['stmts'] = self.linear_stmt(gcn_embeds['stmts'])
-        gcn_embeds['stmts'] += torch.mm(torch.transpose(adj_head, 0, 1), self.linear_head_adj_ere(gcn_embeds['eres']))
-        gcn_embeds['stmts'] += torch.mm(torch.transpose(adj_tail, 0, 1), self.linear_tail_adj_ere(gcn_embeds['eres']))
-        gcn_embeds['stmts'] = self.conv_dropout(F.relu(gcn_embeds['stmts']))
-
-        # Layer 3 (if applicable)
-        if self.num_layers >= 3:
-            gcn_embeds['eres'] = self.linear_ere_3(gcn_embeds['eres'])
-            gcn_embeds['eres'] += torch.mm(adj_head, self.linear_head_adj_stmt_3(gcn_embeds['stmts']))
-            gcn_embeds['eres'] += torch.mm(adj_tail, self.linear_tail_adj_stmt_3(gcn_embeds['stmts']))
-            gcn_embeds['eres'] += torch.mm(adj_type, self.linear_type_adj_stmt_3(gcn_embeds['stmts']))
-            gcn_embeds['eres'] = self.conv_dropout(F.relu(gcn_embeds['eres']))
-
-            gcn_embeds['stmts'] = self.linear_stmt_3(gcn_embeds['stmts'])
-            gcn_embeds['stmts'] += torch.mm(torch.transpose(adj_head, 0, 1), self.linear_head_adj_ere_3(gcn_embeds['eres']))
-            gcn_embeds['stmts'] += torch.mm(torch.transpose(adj_tail, 0, 1), self.linear_tail_adj_ere_3(gcn_embeds['eres']))
-            gcn_embeds['stmts'] = self.conv_dropout(F.relu(gcn_embeds['stmts']))
-
-        # Layer 4 (if applicable)
-        if self.num_layers == 4:
-            gcn_embeds['eres'] = self.linear_ere_4(gcn_embeds['eres'])
-            gcn_embeds['eres'] += torch.mm(adj_head, self.linear_head_adj_stmt_4(gcn_embeds['stmts']))
-            gcn_embeds['eres'] += torch.mm(adj_tail, self.linear_tail_adj_stmt_4(gcn_embeds['stmts']))
-            gcn_embeds['eres'] += torch.mm(adj_type, self.linear_type_adj_stmt_4(gcn_embeds['stmts']))
-            gcn_embeds['eres'] = self.conv_dropout(F.relu(gcn_embeds['eres']))
+        ere_emb = embed_label_sets(self.ere_embedder, ere_labels, adj_ere.shape[0], device)
+        stmt_emb = embed_label_sets(self.stmt_embedder, stmt_labels, adj_stmt.shape[0], device)
+
+        activation = compiled_relu_dropout if adj_ere.is_cuda else relu_dropout
+        hidden_size = self.hidden_size
+        dropout_p = self.conv_dropout.p
+        training = self.training
+
+        eres = ere_emb
+        stmts = stmt_emb
+
+        for linear_ere, stmt_linears, ere_linears in self.gcn_layers():
+            # The head/tail/type projections of a layer (and, on the stmt side, the stmt self projection) read the same input,
+            # so each side computes them in one matmul; viewing the result as one row per (node, relation) pair lines it up
+            # with the interleaved adjacency columns, so one SpMM sums the aggregations over all relations and addmm adds
+            # them onto the self projection
+            stmt_proj = fused_linear(stmts, stmt_linears)
 
-            gcn_embeds['stmts'] = self.linear_stmt_4(gcn_embeds['stmts'])
-            gcn_embeds['stmts'] += torch.mm(torch.transpose(adj_head, 0, 1), self.linear_head_adj_ere_4(gcn_embeds['eres']))
-            gcn_embeds['stmts'] += torch.mm(torch.transpose(adj_tail, 0, 1), self.linear_tail_adj_ere_4(gcn_embeds['eres']))
-            gcn_embeds['stmts'] = self.conv_dropout(F.relu(gcn_embeds['stmts']))
+            eres = torch.addmm(linear_ere(eres), adj_ere, stmt_proj.view(-1, hidden_size))
+            eres = activation(eres, dropout_p, training)
+
+            ere_proj = fused_linear(eres, ere_linears)
+
+            stmts = torch.addmm(stmt_proj[:, 3 * hidden_size:], adj_stmt, ere_proj.view(-1, hidden_size))
+            stmts = activation(stmts, dropout_p, training)
+
+        gcn_embeds['eres'] = eres
+        gcn_embeds['stmts'] = stmts
 
     def forward(self, graph_dict, gcn_embeds, device):
         # Only calculate GCN embeds for the first in a series of extractions; otherwise, keep passing/retaining the initial embeds
@@ -307,28 +456,34 @@ class CoherenceNetWithGCN(nn.Module):
             gcn_embeds = {'eres': dict(), 'stmts': dict()}
             self.gcn(graph_dict, gcn_embeds, device)
 
-        stmt_attendees = gcn_embeds['stmts'][graph_dict['query_stmts']]
-        ere_attendees = gcn_embeds['eres'][list(graph_dict['query_eres'])]
+        # The query/candidate sets change between extractions (next_state() rebuilds the query sets with set operations and
+        # extends candidates in place), so they stay host-side; instead, all indices needed by this call are uploaded to the
+        # device in a single copy and split there. Query stmts and candidates index the same embeddings, so they are
+        # gathered together and the result is split
+        query_stmts = graph_dict['query_stmts']
+        query_eres = list(graph_dict['query_eres'])
+        candidates = [] if self.plaus else graph_dict['candidates']
 
-        if self.plaus:
-            self_att_vectors_stmts = self.coherence_attention.get_attention_vectors(stmt_attendees, None, stmt_attendees)
-            self_att_vectors_eres = self.coherence_attention.get_attention_vectors(None, ere_attendees, ere_attendees)
+        indices = indices_to_device(np.concatenate([query_stmts, candidates, query_eres]), device)
+        stmt_index, ere_index = indices.split([len(query_stmts) + len(candidates), len(query_eres)])
 
-            stmts_vector = torch.mean(self_att_vectors_stmts, dim=0)
-            eres_vector = torch.mean(self_att_vectors_eres, dim=0)
+        ere_attendees = gcn_embeds['eres'].index_select(0, ere_index)
+        stmt_attendees, attenders = gcn_embeds['stmts'].index_select(0, stmt_index).split([len(query_stmts), len(candidates)])
 
-            final_vector = torch.cat([stmts_vector, eres_vector], dim=0)
+        if self.plaus:
+            stmt_attention_weights = self.coherence_attention.get_attention_weights(stmt_attendees, None, stmt_attendees)
+            ere_attention_weights = self.coherence_attention.get_attention_weights(None, ere_attendees, ere_attendees)
 
-            plaus_out = self.linear_plaus(final_vector)
+            if stmt_attendees.is_cuda:
+                plaus_out = compiled_score_plausibility(self, stmt_attendees, stmt_attention_weights, ere_attendees, ere_attention_weights)
+            else:
+                plaus_out = score_plausibility(self, stmt_attendees, stmt_attention_weights, ere_attendees, ere_attention_weights)
 
             return plaus_out, gcn_embeds
         else:
-            attenders = gcn_embeds['stmts'][graph_dict['candidates']]
-
-            # Get attention vectors for candidate statements
-            coherence_attention_vectors = self.coherence_attention.get_attention_vectors(stmt_attendees, ere_attendees, attenders)
-
-            # Obtain a final set of logits for the candidate statements (softmax later)
-            coherence_out = self.coherence_linear(coherence_attention_vectors).squeeze(-1)
+            if attenders.is_cuda:
+                coherence_attention_vectors, coherence_out = compiled_score_candidates(self, stmt_attendees, ere_attendees, attenders)
+            else:
+                coherence_attention_vectors, coherence_out = score_candidates(self, stmt_attendees, ere_attendees, attenders)
 
             return coherence_attention_vectors, coherence_out, gcn_embeds
\ No newline at end of file
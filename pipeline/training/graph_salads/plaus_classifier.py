@@ -218,10 +218,11 @@ def run_no_backprop(index_data_dir, data_path, model, loss_func):
 
     valid_losses, valid_accuracies = [], []
 
-    while valid_iter.epoch == 0:
-        valid_loss, valid_accuracy = run_classifier(model, None, valid_iter.next_batch(), loss_func, 'Val', device)
-        valid_losses.append(valid_loss)
-        valid_accuracies.append(valid_accuracy)
+    with torch.no_grad():
+        while valid_iter.epoch == 0:
+            valid_loss, valid_accuracy = run_classifier(model, None, valid_iter.next_batch(), loss_func, 'Val', device)
+            valid_losses.append(valid_loss)
+            valid_accuracies.append(valid_accuracy)
 
     average_valid_loss = np.mean(valid_losses)
     average_valid_accuracy = np.mean(valid_accuracies)
@@ -271,16 +272,17 @@ def eval_plaus(indexer_info_file, model_path, kb_path, list_of_clusters, attenti
 
         plaus_cluster_ere_ind_sets.append(temp)
 
-    for i in range(len(plaus_cluster_stmt_ind_sets)):
-        graph_dict['query_stmts'] = plaus_cluster_stmt_ind_sets[i]
-        graph_dict['query_eres'] = plaus_cluster_ere_ind_sets[i]
+    with torch.no_grad():
+        for i in range(len(plaus_cluster_stmt_ind_sets)):
+            graph_dict['query_stmts'] = plaus_cluster_stmt_ind_sets[i]
+            graph_dict['query_eres'] = plaus_cluster_ere_ind_sets[i]
 
-        if i == 0:
-            pred_logit, gcn_embeds = model(graph_dict, None, device)
-        else:
-            pred_logit, _ = model(graph_dict, gcn_embeds, device)
+            if i == 0:
+                pred_logit, gcn_embeds = model(graph_dict, None, device)
+            else:
+                pred_logit, _ = model(graph_dict, gcn_embeds, device)
 
-        preds.append(torch.sigmoid(pred_logit).item())
+            preds.append(torch.sigmoid(pred_logit).item())
 
     return preds
 
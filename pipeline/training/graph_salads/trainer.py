@@ -117,8 +117,8 @@ def admit_seq(force, prob_force, model, optimizer, graph_dict, data_group, use_h
 # Train the model on a set of graph salads
 def train(batch_size, extraction_size, weight_decay, force, init_prob_force, force_decay, force_every, train_path, valid_path, test_path, indexer_info_dict, self_attend,
           attention_type, attn_head_stmt_tail, num_layers, hidden_size, attention_size, conv_dropout, attention_dropout, num_epochs, learning_rate, save_path, load_path, load_optim,
-          use_highest_ranked_gold, valid_every, print_every, device):
-    model = CoherenceNetWithGCN(False, indexer_info_dict, attention_type, None, num_layers, hidden_size, attention_size, conv_dropout, attention_dropout).to(device)
+          use_highest_ranked_gold, valid_every, print_every, share_layer_weights, device):
+    model = CoherenceNetWithGCN(False, indexer_info_dict, attention_type, None, num_layers, hidden_size, attention_size, conv_dropout, attention_dropout, share_layer_weights).to(device)
 
     # If a pretrained model should be used, load its parameters in
     if load_path is not None:
@@ -204,12 +204,13 @@ def run_no_backprop(data_path, extraction_size, model):
 
     valid_losses, valid_accuracies = [], []
 
-    while valid_iter.epoch == 0:
-        result = admit_seq(False, None, model, None, valid_iter.next_batch(), "Val", False, extraction_size, False, device)
-        if result:
-            valid_loss, valid_accuracy = result
-            valid_losses.append(valid_loss)
-            valid_accuracies.append(valid_accuracy)
+    with torch.no_grad():
+        while valid_iter.epoch == 0:
+            result = admit_seq(False, None, model, None, valid_iter.next_batch(), "Val", False, extraction_size, False, device)
+            if result:
+                valid_loss, valid_accuracy = result
+                valid_losses.append(valid_loss)
+                valid_accuracies.append(valid_accuracy)
 
     average_valid_loss = np.mean(valid_losses)
     average_valid_accuracy = np.mean(valid_accuracies)
@@ -247,6 +248,8 @@ if __name__ == "__main__":
                         help="Maximum number of statements to admit per graph salad")
     parser.add_argument("--num_layers", type=int, default=2,
                         help="Number of layers in the GCN")
+    parser.add_argument("--share_layer_weights", action='store_true',
+                        help="GCN layers 3 and 4 reuse the weights of layer 2")
     parser.add_argument("--attention_type", type=str, default='concat',
                         help="Attention score type for inference (can be concat or bilinear)")
     parser.add_argument("--self_attend", action='store_true',
@@ -314,7 +317,7 @@ if __name__ == "__main__":
     # Train a fresh model
     if mode == 'train':
         train(batch_size, extraction_size, weight_decay, force, init_prob_force, force_decay, force_every, train_path, valid_path, test_path, indexer_info_dict, self_attend, attention_type, attn_head_stmt_tail, num_layers, hidden_size, attention_size, conv_dropout, attention_dropout, num_epochs,
-                      learning_rate, save_path, load_path, load_optim, use_highest_ranked_gold, valid_every, print_every, device)
+                      learning_rate, save_path, load_path, load_optim, use_highest_ranked_gold, valid_every, print_every, share_layer_weights, device)
     # Evaluate an existing model on test data
     elif mode == 'validate':
         model = CoherenceNetWithGCN(indexer_info_dict, self_attend, attention_type, num_layers, hidden_size, attention_size, conv_dropout, attention_dropout).to(device)